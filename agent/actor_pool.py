@@ -0,0 +1,152 @@
+import multiprocessing as mp
+import queue
+import gym
+import numpy as np
+
+BATCH_SIZE = 64 # Transitions sent together by an actor
+BASE_EPSILON = 0.4
+EPSILON_ALPHA = 7
+QUEUE_TIMEOUT = 0.5 # Seconds between checks for stopped processes while waiting on the queue
+
+def actor_epsilons(num_actors, base=BASE_EPSILON, alpha=EPSILON_ALPHA):
+  """Epsilon of each actor, from base down to base ** (1 + alpha), so that
+  some actors explore and others mostly follow the policy."""
+  if num_actors == 1:
+    return [base]
+  return [base ** (1 + alpha * i / (num_actors - 1)) for i in range(num_actors)]
+
+def _split_weights(flat, shapes):
+  sizes = [int(np.prod(shape)) for shape in shapes]
+  parts = np.split(flat, np.cumsum(sizes)[:-1])
+  return [part.reshape(shape) for part, shape in zip(parts, shapes)]
+
+def _actor(rank, env_id, seed, epsilon, batch_size, transitions, weights_raw, version, lock,
+           shapes, stop):
+  """Plays with its own env and copy of the model, sending batches of
+  transitions and the rewards of finished episodes to the learner."""
+  import tensorflow as tf
+  from snake_agent import create_model
+  # Actors share the cores, one thread each
+  tf.config.threading.set_intra_op_parallelism_threads(1)
+  tf.config.threading.set_inter_op_parallelism_threads(1)
+  env = gym.make(env_id)
+  env.seed(seed)
+  rng = np.random.RandomState(seed)
+  num_actions = env.action_space.n
+  model = create_model(env.observation_space.shape, num_actions)
+  model_version = -1
+  shared_weights = np.frombuffer(weights_raw, dtype=np.float32)
+
+  obs_shape = env.observation_space.shape
+  states = np.zeros((batch_size, *obs_shape), dtype=np.uint8)
+  new_states = np.zeros((batch_size, *obs_shape), dtype=np.uint8)
+  actions = np.zeros(batch_size, dtype=np.int8)
+  rewards = np.zeros(batch_size, dtype=np.float32)
+  dones = np.zeros(batch_size, dtype=np.bool_)
+  episode_rewards = []
+  episode_reward = 0
+  count = 0
+  state = env.reset()
+  while not stop.is_set():
+    if version.value != model_version:
+      with lock:
+        model_version = version.value
+        flat = shared_weights.copy()
+      model.set_weights(_split_weights(flat, shapes))
+    if rng.uniform() <= epsilon:
+      action = rng.randint(num_actions)
+    else:
+      action = int(np.argmax(model(np.reshape(state, (1, *obs_shape)), training=False)))
+    new_state, reward, done, _info = env.step(action)
+    states[count] = state
+    actions[count] = action
+    rewards[count] = reward
+    new_states[count] = new_state
+    dones[count] = done
+    count += 1
+    episode_reward += reward
+    if done:
+      episode_rewards.append(episode_reward)
+      episode_reward = 0
+      state = env.reset()
+    else:
+      state = new_state
+    if count == batch_size:
+      batch = (rank, (states.copy(), actions.copy(), rewards.copy(), new_states.copy(), dones.copy()),
+               episode_rewards)
+      while not stop.is_set():
+        try:
+          transitions.put(batch, timeout=QUEUE_TIMEOUT)
+          break
+        except queue.Full:
+          pass
+      episode_rewards = []
+      count = 0
+  env.close()
+
+class ActorPool:
+  """Actor processes feeding the transitions of their games to a learner,
+  in the manner of Ape-X.
+
+  Each actor has its own env, seeded with seed + rank, its own epsilon
+  (see actor_epsilons) and its own copy of the model, which it runs on a
+  single thread. Transitions are sent in batches through a bounded queue,
+  so actors wait when the learner falls far behind. The learner publishes
+  weights into shared memory with a version number, which actors check
+  before every action.
+  """
+  def __init__(self, num_actors, env_id, weights, seed=0, batch_size=BATCH_SIZE,
+               epsilons=None, start_method=None):
+    if start_method is None:
+      # Forking a process that already runs TensorFlow is not safe
+      start_method = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+    ctx = mp.get_context(start_method)
+    self.epsilons = epsilons or actor_epsilons(num_actors)
+    self.shapes = [w.shape for w in weights]
+    size = sum(w.size for w in weights)
+    self.weights_raw = ctx.RawArray('f', size)
+    self.shared_weights = np.frombuffer(self.weights_raw, dtype=np.float32)
+    self.version = ctx.RawValue('l', 0)
+    self.lock = ctx.Lock()
+    self.stop = ctx.Event()
+    self.transitions = ctx.Queue(maxsize=4 * num_actors)
+    self.publish(weights)
+    self.processes = []
+    for rank in range(num_actors):
+      args = (rank, env_id, seed + rank, self.epsilons[rank], batch_size, self.transitions,
+              self.weights_raw, self.version, self.lock, self.shapes, self.stop)
+      process = ctx.Process(target=_actor, args=args, daemon=True)
+      process.start()
+      self.processes.append(process)
+
+  def publish(self, weights):
+    """Sends new weights to the actors."""
+    with self.lock:
+      self.shared_weights[:] = np.concatenate([w.reshape(-1) for w in weights])
+      self.version.value += 1
+
+  def get_batches(self, block=False):
+    """Returns the batches sent since the last call, as (rank, transition
+    columns, rewards of finished episodes) tuples. With block, waits for at
+    least one."""
+    batches = []
+    while block and not batches:
+      try:
+        batches.append(self.transitions.get(timeout=QUEUE_TIMEOUT))
+      except queue.Empty:
+        if not any(process.is_alive() for process in self.processes):
+          raise RuntimeError('All actors have stopped')
+    try:
+      while True:
+        batches.append(self.transitions.get_nowait())
+    except queue.Empty:
+      pass
+    return batches
+
+  def close(self):
+    self.stop.set()
+    # Take what actors are still sending, so that none blocks on the queue
+    while any(process.is_alive() for process in self.processes):
+      self.get_batches()
+      for process in self.processes:
+        process.join(timeout=0.1)
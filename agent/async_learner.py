@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+from snake_agent import MIN_REPLAY_MEMORY_SIZE
+
+UPDATE_RATIO = 1.0 # Gradient steps per env step, at most
+TARGET_SYNC_EVERY = 1000 # Gradient steps between target network syncs
+PUBLISH_EVERY = 50 # Gradient steps between weights published to the actor
+
+class AsyncLearner(threading.Thread):
+  """Trains a SnakeAgent in a background thread, while the actor loop keeps
+  stepping the env.
+
+  The actor pushes transitions and picks actions with its own copy of the
+  model, so it never waits on a gradient step. The learner trains from the
+  replay memory as long as it has done fewer than update_ratio gradient
+  steps per env step, and sleeps otherwise. When it falls behind, the
+  actor does not slow down.
+
+  Every publish_every gradient steps, the learner publishes a copy of its
+  weights with a new version number, which the actor loads on its next
+  action. The target network is synced every target_sync_every gradient
+  steps, counted by target_version.
+
+  If training raises, the learner stops and the exception is raised again
+  by the next push, get_qs or stop call of the actor.
+  """
+  def __init__(self, agent, update_ratio=UPDATE_RATIO, target_sync_every=TARGET_SYNC_EVERY,
+               publish_every=PUBLISH_EVERY):
+    threading.Thread.__init__(self, name='learner', daemon=True)
+    self.agent = agent
+    self.update_ratio = update_ratio
+    self.target_sync_every = target_sync_every
+    self.publish_every = publish_every
+    self.actor_model = agent.create_model()
+    self.actor_model.set_weights(agent.model.get_weights())
+    self.actor_version = 0
+    self.weights_version = 0
+    self.published_weights = None
+    self.target_version = 0
+    self.env_steps = 0
+    self.gradient_steps = 0
+    self.stopping = False
+    self.error = None
+    # Guards the replay memory, counters and published weights
+    self.cond = threading.Condition()
+
+  def _raise_error(self):
+    if self.error is not None:
+      raise RuntimeError('The learner thread stopped') from self.error
+
+  def push(self, transition):
+    """Adds a transition from the actor to the replay memory."""
+    self._raise_error()
+    with self.cond:
+      self.agent.append_memory(transition)
+      self.env_steps += 1
+      if self._can_train():
+        self.cond.notify()
+
+  def get_qs(self, state):
+    """Q values of the actor model, after loading the latest published
+    weights."""
+    self._raise_error()
+    if self.actor_version != self.weights_version:
+      with self.cond:
+        version, weights = self.weights_version, self.published_weights
+      self.actor_model.set_weights(weights)
+      self.actor_version = version
+    return self.actor_model(np.reshape(state, (1, *state.shape)), training=False).numpy()
+
+  def _can_train(self):
+    return len(self.agent.replay_memory) >= MIN_REPLAY_MEMORY_SIZE \
+        and self.gradient_steps < self.env_steps * self.update_ratio
+
+  def run(self):
+    try:
+      self._train()
+    except Exception as e: # pylint: disable=broad-except
+      self.error = e
+
+  def _train(self):
+    agent = self.agent
+    while True:
+      with self.cond:
+        self.cond.wait_for(lambda: self.stopping or self._can_train())
+        if self.stopping:
+          return
+        indices, minibatch, weights = agent.sample_minibatch()
+      td_errors = agent.fit_minibatch(minibatch, weights)
+      with self.cond:
+        # Slots overwritten since sampling get a priority they did not earn,
+        # which is corrected the next time they are sampled
+        agent.replay_memory.update_priorities(indices, td_errors)
+        self.gradient_steps += 1
+        steps = self.gradient_steps
+      if steps % self.target_sync_every == 0:
+        agent.target_model.set_weights(agent.model.get_weights())
+        self.target_version += 1
+      if steps % self.publish_every == 0:
+        weights = agent.model.get_weights()
+        with self.cond:
+          self.published_weights = weights
+          self.weights_version += 1
+
+  def stop(self):
+    with self.cond:
+      self.stopping = True
+      self.cond.notify()
+    self.join()
+    self._raise_error()
@@ -0,0 +1,194 @@
+import numpy as np
+
+class ReplayMemory:
+  """Replay memory of (state, action, reward, new_state, done) transitions,
+  kept in preallocated column arrays written by a circular pointer.
+
+  Observations are stored once, in the slot of the transition they start.
+  Within an episode, the new state of a transition is the state of the next
+  one, so each transition only holds the slot index of its new state. The
+  new state of a terminal transition is not stored, as it is never used
+  for its target. Slots that only hold the new state of the latest
+  transition, or of an episode cut short, are never sampled.
+  """
+  def __init__(self, capacity, obs_shape, obs_dtype=np.uint8):
+    self.capacity = capacity
+    self.states = np.zeros((capacity, *obs_shape), dtype=obs_dtype)
+    self.actions = np.zeros(capacity, dtype=np.int8)
+    self.rewards = np.zeros(capacity, dtype=np.float32)
+    self.dones = np.zeros(capacity, dtype=np.bool_)
+    self.next_index = np.zeros(capacity, dtype=np.int32)
+    self.valid = np.zeros(capacity, dtype=np.bool_)
+    self.pointer = 0
+    self.filled = 0 # Slots written at least once
+    self.size = 0 # Valid transitions
+    self.last_done = True
+
+  def __len__(self):
+    return self.size
+
+  def _advance(self):
+    self.pointer = (self.pointer + 1) % self.capacity
+    self.filled = max(self.filled, self.pointer if self.pointer else self.capacity)
+
+  def _invalidate(self, slot):
+    if self.valid[slot]:
+      self.valid[slot] = False
+      self.size -= 1
+
+  def _validate(self, slot):
+    self.valid[slot] = True
+    self.size += 1
+
+  def append(self, transition):
+    state, action, reward, new_state, done = transition
+    p = self.pointer
+    # The new state of the last transition was written at p
+    if self.last_done or not np.array_equal(state, self.states[p]):
+      if not self.last_done:
+        # Keep the new state of an episode cut short
+        self._advance()
+        p = self.pointer
+      self._invalidate(p)
+      self.states[p] = state
+    self.actions[p] = action
+    self.rewards[p] = reward
+    self.dones[p] = done
+    self._validate(p)
+    self._advance()
+    if done:
+      self.next_index[p] = p
+    else:
+      self.next_index[p] = self.pointer
+      self._invalidate(self.pointer)
+      self.states[self.pointer] = new_state
+    self.last_done = done
+
+  def sample_indices(self, batch_size):
+    """Draws batch_size slots of valid transitions, with replacement. Only
+    a few slots are invalid, so the ones drawn are simply drawn again."""
+    indices = np.random.randint(self.filled, size=batch_size)
+    invalid = ~self.valid[indices]
+    while invalid.any():
+      indices[invalid] = np.random.randint(self.filled, size=np.count_nonzero(invalid))
+      invalid = ~self.valid[indices]
+    return indices
+
+  def batch(self, indices):
+    """Returns the columns of the given transitions as contiguous arrays:
+    states, actions, rewards, new states and dones."""
+    return (self.states[indices], self.actions[indices], self.rewards[indices],
+            self.states[self.next_index[indices]], self.dones[indices])
+
+  def sample(self, batch_size):
+    return self.batch(self.sample_indices(batch_size))
+
+  def weights(self, _indices):
+    """Importance-sampling weights of sampled transitions, None when they
+    are drawn uniformly."""
+    return None
+
+  def update_priorities(self, indices, td_errors):
+    pass
+
+class SumTree:
+  """Binary tree of sums over an array of leaf values, stored in an array:
+  node i has children 2i and 2i + 1, the root is node 1 and leaves start at
+  node len(tree) / 2. Updates and searches take O(log n) and work on
+  arrays of leaves at once."""
+  def __init__(self, size):
+    self.leaf_start = 1 << max(size - 1, 1).bit_length()
+    self.tree = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+  def total(self):
+    return self.tree[1]
+
+  def get(self, leaves):
+    return self.tree[self.leaf_start + leaves]
+
+  def set(self, leaf, value):
+    """Updates a single leaf, cheaper than update for one value."""
+    tree = self.tree
+    node = self.leaf_start + leaf
+    tree[node] = value
+    while node > 1:
+      node //= 2
+      tree[node] = tree[2 * node] + tree[2 * node + 1]
+
+  def update(self, leaves, values):
+    nodes = self.leaf_start + np.asarray(leaves)
+    self.tree[nodes] = values
+    # All leaves are on the same level, so each pass moves up one level.
+    # Repeated nodes are written twice with the same sum.
+    while nodes[0] > 1:
+      nodes = nodes // 2
+      self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+  def find(self, values):
+    """Returns the leaves where the cumulative sums reach values."""
+    nodes = np.ones(len(values), dtype=np.int64)
+    values = np.array(values, dtype=np.float64)
+    while nodes[0] < self.leaf_start:
+      left = self.tree[2 * nodes]
+      right = values >= left
+      values -= left * right
+      nodes = 2 * nodes + right
+    return nodes - self.leaf_start
+
+class PrioritizedReplayMemory(ReplayMemory):
+  """Replay memory drawing transitions with probability proportional to
+  priority ** alpha, where the priority is the absolute TD error of the
+  transition when it was last trained on. New transitions get the highest
+  priority seen so far, so they are trained on at least once.
+
+  Sampled transitions have importance-sampling weights correcting the bias
+  of prioritized sampling, with exponent beta annealed from beta to 1 over
+  beta_steps samples.
+  """
+  def __init__(self, capacity, obs_shape, obs_dtype=np.uint8, alpha=0.6, beta=0.4,
+               beta_steps=100_000, epsilon=1e-3):
+    ReplayMemory.__init__(self, capacity, obs_shape, obs_dtype)
+    self.tree = SumTree(capacity)
+    self.alpha = alpha
+    self.beta_start = beta
+    self.beta = beta
+    self.beta_steps = beta_steps
+    self.epsilon = epsilon
+    self.max_priority = 1.0
+    self.sample_count = 0
+
+  def _invalidate(self, slot):
+    if self.valid[slot]:
+      self.tree.set(slot, 0.0)
+    ReplayMemory._invalidate(self, slot)
+
+  def _validate(self, slot):
+    ReplayMemory._validate(self, slot)
+    self.tree.set(slot, self.max_priority ** self.alpha)
+
+  def sample_indices(self, batch_size):
+    """Draws one transition from each of batch_size equal segments of the
+    total priority."""
+    segment = self.tree.total() / batch_size
+    values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+    indices = np.minimum(self.tree.find(values), self.capacity - 1)
+    # Rounding can end a search on an empty leaf
+    invalid = ~self.valid[indices]
+    while invalid.any():
+      values = np.random.uniform(high=self.tree.total(), size=np.count_nonzero(invalid))
+      indices[invalid] = np.minimum(self.tree.find(values), self.capacity - 1)
+      invalid = ~self.valid[indices]
+    self.sample_count += 1
+    progress = min(self.sample_count / self.beta_steps, 1.0)
+    self.beta = self.beta_start + (1.0 - self.beta_start) * progress
+    return indices
+
+  def weights(self, indices):
+    probabilities = self.tree.get(indices) / self.tree.total()
+    weights = (self.size * probabilities) ** -self.beta
+    return (weights / weights.max()).astype(np.float32)
+
+  def update_priorities(self, indices, td_errors):
+    priorities = np.abs(td_errors) + self.epsilon
+    self.max_priority = max(self.max_priority, float(priorities.max()))
+    self.tree.update(indices, priorities ** self.alpha)
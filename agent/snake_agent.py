@@ -1,9 +1,9 @@
-import random
 import time
 import numpy as np
-from collections import deque
-from tensorflow.keras import models, layers
+import tensorflow as tf
+from tensorflow.keras import models, layers, losses
 from modified_tensor_board import ModifiedTensorBoard
+from replay_memory import ReplayMemory, PrioritizedReplayMemory
 
 DISCOUNT = 0.3
 MODEL_NAME = 'snake_dqn'
@@ -13,25 +13,33 @@ MIN_REPLAY_MEMORY_SIZE = 200
 MINIBATCH_SIZE = 40
 UPDATE_TARGET_EVERY = 5
 
+def create_model(obs_shape, num_actions):
+  model = models.Sequential()
+  model.add(layers.Conv2D(filters=16, kernel_size=(4,4), strides=(2,2), activation='relu', padding="valid", input_shape=obs_shape))
+  model.add(layers.Conv2D(filters=32, kernel_size=(2,2), strides=(1,1), activation='relu', padding="valid"))
+  model.add(layers.Flatten())
+  model.add(layers.Dense(256, activation="relu"))
+  model.add(layers.Dense(num_actions, activation="softmax"))
+
+  model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
+  return model
+
 class SnakeAgent:
-  def __init__(self, env):
+  def __init__(self, env, prioritized=False):
     self.env = env
     self.model = self.create_model()
     self.target_model = self.create_model()
-    self.replay_memory = deque(maxlen=REPLAY_MEMORY_SIZE)
+    # Prioritized replay trains more often on rare transitions, such as
+    # eating an apple or dying
+    memory_class = PrioritizedReplayMemory if prioritized else ReplayMemory
+    self.replay_memory = memory_class(REPLAY_MEMORY_SIZE, env.observation_space.shape)
     self.tensorboard = ModifiedTensorBoard(log_dir=f"logs/{MODEL_NAME}-{int(time.time())}")
     self.target_update_counter = 0
+    self.uniform_weights = np.ones(MINIBATCH_SIZE, dtype=np.float32)
+    self.train_step = tf.function(self._train_step)
 
   def create_model(self):
-    model = models.Sequential()
-    model.add(layers.Conv2D(filters=16, kernel_size=(4,4), strides=(2,2), activation='relu', padding="valid", input_shape=self.env.observation_space.shape))
-    model.add(layers.Conv2D(filters=32, kernel_size=(2,2), strides=(1,1), activation='relu', padding="valid"))
-    model.add(layers.Flatten())
-    model.add(layers.Dense(256, activation="relu"))
-    model.add(layers.Dense(self.env.action_space.n, activation="softmax"))
-
-    model.compile(loss='categorical_crossentropy', optimizer='adam', metrics=['accuracy'])
-    return model
+    return create_model(self.env.observation_space.shape, self.env.action_space.n)
 
   def append_memory(self, transition):
     self.replay_memory.append(transition)
@@ -40,41 +48,9 @@ class SnakeAgent:
     if len(self.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
       return
 
-    minibatch = random.sample(self.replay_memory, MINIBATCH_SIZE)
-
-    # Get current states from minibatch, then query NN model for Q values
-    current_states = np.array([transition[0] for transition in minibatch])
-    current_qs_list = self.model.predict(current_states)
-
-    # Get future states from minibatch, then query NN model for Q values
-    # When using target network, query it, otherwise main network should be queried
-    new_current_states = np.array([transition[3] for transition in minibatch])
-    future_qs_list = self.target_model.predict(new_current_states)
-
-    X = []
-    y = []
-
-    # Now we need to enumerate our batches
-    for index, (current_state, action, reward, _new_current_state, done) in enumerate(minibatch):
-
-      # If not a terminal state, get new q from future states, otherwise set it to 0
-      # almost like with Q Learning, but we use just part of equation here
-      if not done:
-        max_future_q = np.max(future_qs_list[index])
-        new_q = reward + DISCOUNT * max_future_q
-      else:
-        new_q = reward
-
-      # Update Q value for given state
-      current_qs = current_qs_list[index]
-      current_qs[action] = new_q
-
-      # And append to our training data
-      X.append(current_state)
-      y.append(current_qs)
-
-    # Fit on all samples as one batch, log only on terminal state
-    self.model.fit(np.array(X), np.array(y), batch_size=MINIBATCH_SIZE, verbose=0, shuffle=False, callbacks=[self.tensorboard] if terminal_state else None)
+    indices, minibatch, weights = self.sample_minibatch()
+    td_errors = self.fit_minibatch(minibatch, weights)
+    self.replay_memory.update_priorities(indices, td_errors)
 
     # Update target network counter every episode
     if terminal_state:
@@ -85,5 +61,42 @@ class SnakeAgent:
       self.target_model.set_weights(self.model.get_weights())
       self.target_update_counter = 0
 
+  def sample_minibatch(self):
+    """Returns the replay memory slots of a minibatch, its columns and the
+    weights of its transitions."""
+    indices = self.replay_memory.sample_indices(MINIBATCH_SIZE)
+    minibatch = self.replay_memory.batch(indices)
+    weights = self.replay_memory.weights(indices)
+    if weights is None:
+      weights = self.uniform_weights
+    return indices, minibatch, weights
+
+  def fit_minibatch(self, minibatch, weights):
+    """Fits the model on a minibatch, returning the TD errors."""
+    current_states, actions, rewards, new_current_states, dones = minibatch
+    td_errors = self.train_step(current_states, actions.astype(np.int32), rewards,
+                                new_current_states, dones, weights)
+    return td_errors.numpy()
+
+  def _train_step(self, current_states, actions, rewards, new_current_states, dones, weights):
+    """Fits the model on one minibatch, returning the TD errors. Compiled
+    into a TF graph by __init__, so that the whole update runs without
+    going back to Python."""
+    # Query the target network for Q values of future states. Terminal
+    # states have no future, their new Q value is the reward alone
+    future_qs = self.target_model(tf.cast(new_current_states, tf.float32), training=False)
+    new_qs = rewards + DISCOUNT * tf.reduce_max(future_qs, axis=1) * (1.0 - tf.cast(dones, tf.float32))
+    action_mask = tf.one_hot(actions, self.env.action_space.n, dtype=tf.bool)
+
+    with tf.GradientTape() as tape:
+      current_qs = self.model(tf.cast(current_states, tf.float32), training=True)
+      # Target is the current Q values, with the one of the action taken
+      # replaced by its new Q value
+      targets = tf.where(action_mask, new_qs[:, None], tf.stop_gradient(current_qs))
+      loss = tf.reduce_mean(weights * losses.categorical_crossentropy(targets, current_qs))
+    gradients = tape.gradient(loss, self.model.trainable_variables)
+    self.model.optimizer.apply_gradients(zip(gradients, self.model.trainable_variables))
+    return new_qs - tf.reduce_sum(tf.where(action_mask, current_qs, 0.0), axis=1)
+
   def get_qs(self, state):
-    return self.model.predict(np.reshape(state, (1, *self.env.observation_space.shape)))
+    return self.model(np.reshape(state, (1, *self.env.observation_space.shape)), training=False).numpy()
@@ -0,0 +1,54 @@
+import multiprocessing as mp
+import time
+import gym
+import numpy as np
+from snake_agent import SnakeAgent, MODEL_NAME, MIN_REPLAY_MEMORY_SIZE
+from async_learner import TARGET_SYNC_EVERY, PUBLISH_EVERY
+from actor_pool import ActorPool
+
+ENV_ID = 'snake_gym:Snake-v0'
+NUM_ACTORS = max(mp.cpu_count() - 1, 1) # One core is left to the learner
+GRADIENT_STEPS = 1_000_000
+AGGREGATE_STATS_EVERY = 100 # Episodes
+MIN_REWARD = 7
+
+if __name__ == '__main__':
+  env = gym.make(ENV_ID)
+  agent = SnakeAgent(env, prioritized=True)
+  pool = ActorPool(NUM_ACTORS, ENV_ID, agent.model.get_weights(), seed=int(time.time()))
+  print(f"{NUM_ACTORS} actors, epsilons: {', '.join(f'{e:.4f}' for e in pool.epsilons)}")
+
+  ep_rewards = []
+  env_steps = 0
+  gradient_steps = 0
+  while gradient_steps < GRADIENT_STEPS:
+    # The learner only waits on actors to fill the replay memory at first
+    for _rank, columns, episode_rewards in pool.get_batches(block=len(agent.replay_memory) < MIN_REPLAY_MEMORY_SIZE):
+      for transition in zip(*columns):
+        agent.append_memory(transition)
+      env_steps += len(columns[0])
+      for reward in episode_rewards:
+        ep_rewards.append(reward)
+        if len(ep_rewards) % AGGREGATE_STATS_EVERY == 0:
+          recent = ep_rewards[-AGGREGATE_STATS_EVERY:]
+          reward_avg = sum(recent) / len(recent)
+          reward_min = min(recent)
+          reward_max = max(recent)
+          agent.tensorboard.update_stats(reward_avg=reward_avg, reward_min=reward_min, reward_max=reward_max, episode=len(ep_rewards))
+          print(f"{len(ep_rewards)} episodes, {env_steps} env steps, {gradient_steps} gradient steps, avg reward {reward_avg:.2f}")
+          if reward_avg >= MIN_REWARD:
+            agent.model.save(f'models/{MODEL_NAME}__{reward_max:_>7.2f}max_{reward_avg:_>7.2f}avg_{reward_min:_>7.2f}min__{int(time.time())}.model')
+    if len(agent.replay_memory) < MIN_REPLAY_MEMORY_SIZE:
+      continue
+
+    indices, minibatch, weights = agent.sample_minibatch()
+    td_errors = agent.fit_minibatch(minibatch, weights)
+    agent.replay_memory.update_priorities(indices, td_errors)
+    gradient_steps += 1
+    if gradient_steps % TARGET_SYNC_EVERY == 0:
+      agent.target_model.set_weights(agent.model.get_weights())
+    if gradient_steps % PUBLISH_EVERY == 0:
+      pool.publish(agent.model.get_weights())
+
+  pool.close()
+  env.close()
@@ -2,10 +2,17 @@ import gym
 import numpy as np
 import time
 from snake_agent import SnakeAgent, MODEL_NAME, UPDATE_TARGET_EVERY
+from async_learner import AsyncLearner
 
 env = gym.make('snake_gym:Snake-v0')
 
-agent = SnakeAgent(env)
+PRIORITIZED_REPLAY = True
+agent = SnakeAgent(env, prioritized=PRIORITIZED_REPLAY)
+# Train in a background thread instead of after each env step
+ASYNC_LEARNER = True
+learner = AsyncLearner(agent) if ASYNC_LEARNER else None
+if learner:
+  learner.start()
 
 # NUM_EPISODES = 1_000
 NUM_EPISODES = 1000
@@ -35,13 +42,16 @@ for episode in range(1, NUM_EPISODES + 1):
     if epsilon_test <= epsilon:
       action = env.action_space.sample()
     else:
-      action = np.argmax(agent.get_qs(state))
+      action = np.argmax(learner.get_qs(state) if learner else agent.get_qs(state))
     
     new_state, reward, done, info = env.step(action)
     episode_reward += reward
     # print(f"\rEpisode reward: {episode_reward}", end='')
-    agent.append_memory((state, action, reward, new_state, done))
-    agent.train(done)
+    if learner:
+      learner.push((state, action, reward, new_state, done))
+    else:
+      agent.append_memory((state, action, reward, new_state, done))
+      agent.train(done)
     state = new_state
     if (episode % 10 == 0):
       env.render()
@@ -61,6 +71,10 @@ for episode in range(1, NUM_EPISODES + 1):
   epsilon = MIN_EPSILON + (MAX_EPSILON - MIN_EPSILON)*np.exp(-EPSILON_DECAY_RATE * episode)
   # Save model, but only when min reward is greater or equal a set value
   if reward_avg >= MIN_REWARD:
-      agent.model.save(f'models/{MODEL_NAME}__{reward_max:_>7.2f}max_{reward_avg:_>7.2f}avg_{reward_min:_>7.2f}min__{int(time.time())}.model')
+      # The actor model holds the last published weights, while the
+      # learner keeps changing the agent model
+      (learner.actor_model if learner else agent.model).save(f'models/{MODEL_NAME}__{reward_max:_>7.2f}max_{reward_avg:_>7.2f}avg_{reward_min:_>7.2f}min__{int(time.time())}.model')
 
+if learner:
+  learner.stop()
 env.close()
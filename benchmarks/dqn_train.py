@@ -0,0 +1,67 @@
+"""Compares the time of a SnakeAgent training step with the earlier
+implementation, which ran two Keras predict calls, a Python loop over the
+minibatch and a fit call.
+
+Run from the repository root:
+    python -m benchmarks.dqn_train --steps 200 --grid_size 40
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from plugins.snake_env import SnakeEnv
+
+# The agent modules import each other as scripts run from agent/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'agent'))
+from snake_agent import SnakeAgent, DISCOUNT, MINIBATCH_SIZE, MIN_REPLAY_MEMORY_SIZE # pylint: disable=wrong-import-position
+
+def predict_fit_step(agent):
+    """Training step as it was before being compiled into a TF graph."""
+    current_states, actions, rewards, new_current_states, dones = \
+        agent.replay_memory.sample(MINIBATCH_SIZE)
+    current_qs_list = agent.model.predict(current_states)
+    future_qs_list = agent.target_model.predict(new_current_states)
+    X = []
+    y = []
+    for index in range(MINIBATCH_SIZE):
+        if not dones[index]:
+            new_q = rewards[index] + DISCOUNT * np.max(future_qs_list[index])
+        else:
+            new_q = rewards[index]
+        current_qs = current_qs_list[index]
+        current_qs[actions[index]] = new_q
+        X.append(current_states[index])
+        y.append(current_qs)
+    agent.model.fit(np.array(X), np.array(y), batch_size=MINIBATCH_SIZE, verbose=0, shuffle=False)
+
+def fill_memory(agent, env, steps):
+    rng = np.random.RandomState(0)
+    state = env.reset()
+    for _ in range(steps):
+        action = rng.randint(3)
+        new_state, reward, done, _info = env.step(action)
+        agent.append_memory((state, action, reward, new_state, done))
+        state = env.reset() if done else new_state
+
+def measure(step, steps):
+    step() # Warm up, which also traces the compiled step
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    return (time.perf_counter() - start) / steps
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DQN training step benchmark')
+    parser.add_argument('--grid_size', type=int, default=40)
+    parser.add_argument('--steps', type=int, default=200, help='Training steps timed')
+    parser.add_argument('--prioritized', action='store_true', help='Use prioritized replay')
+    args = parser.parse_args()
+    env = SnakeEnv(grid_size=args.grid_size, seed=1)
+    agent = SnakeAgent(env, prioritized=args.prioritized)
+    fill_memory(agent, env, 2 * MIN_REPLAY_MEMORY_SIZE)
+    before = measure(lambda: predict_fit_step(agent), args.steps)
+    after = measure(lambda: agent.train(False), args.steps)
+    print(f'predict + loop + fit: {before * 1000:8.2f} ms/step')
+    print(f'compiled train step:  {after * 1000:8.2f} ms/step ({before / after:.1f}x faster)')
@@ -0,0 +1,78 @@
+"""Measures the time to import each module of the game in a fresh
+interpreter, and what the import pulled in: heavy libraries, and pygame
+subsystems initialized as a side effect.
+
+Run from the repository root:
+    python -m benchmarks.startup --runs 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import numpy as np
+
+MODULES = [
+    'plugins.snake_env',
+    'plugins.memory_playback',
+    'plugins.base_controller',
+    'plugins.user',
+    'plugins.pg_renderer',
+    'plugins.pg_sprite_renderer',
+    'plugins.sound',
+    'plugins.stable_baselines.ppo2_controller',
+    'plugins.dqn_controller',
+    'game'
+]
+HEAVY_MODULES = ['numpy', 'gym', 'pygame', 'tensorflow', 'stable_baselines']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+try:
+    import {module}
+    error = None
+except Exception as e:
+    error = f'{{type(e).__name__}}: {{e}}'
+elapsed = time.perf_counter() - start
+initialized = []
+if 'pygame' in sys.modules:
+    import pygame
+    for name in ['display', 'font', 'mixer']:
+        subsystem = getattr(pygame, name, None)
+        if subsystem is not None and subsystem.get_init():
+            initialized.append(name)
+print(json.dumps({{
+    'seconds': elapsed,
+    'error': error,
+    'heavy': [name for name in {heavy!r} if name in sys.modules],
+    'initialized': initialized
+}}))
+'''
+
+def probe(module):
+    """Imports module in a new interpreter and returns what it measured."""
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1', SDL_VIDEODRIVER='dummy',
+               SDL_AUDIODRIVER='dummy')
+    output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time benchmark')
+    parser.add_argument('modules', nargs='*', default=MODULES, metavar='MODULE')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module, of which the median is shown. Default: 5')
+    args = parser.parse_args()
+    print(f"{'module':<42}{'ms':>9}  imports / initializes")
+    for module in args.modules:
+        results = [probe(module) for _ in range(args.runs)]
+        last = results[-1]
+        if last['error']:
+            print(f"{module:<42}{'-':>9}  {last['error']}")
+            continue
+        ms = np.median([result['seconds'] for result in results]) * 1000
+        pulled = ', '.join(last['heavy']) or '-'
+        initialized = ', '.join(f'pygame.{name}' for name in last['initialized'])
+        print(f"{module:<42}{ms:>9.1f}  {pulled}{' / ' + initialized if initialized else ''}")
@@ -0,0 +1,299 @@
+"""Benchmark suite of the env, renderers and recordings, on seeded
+workloads. Results can be saved as JSON and compared with a baseline,
+failing when a metric regressed by more than a threshold.
+
+Run from the repository root:
+    python -m benchmarks.suite --save baseline.json
+    python -m benchmarks.suite --compare baseline.json --threshold 0.1
+    python -m benchmarks.suite --only env spawn --repeat 10
+
+Snakes follow a Hamiltonian cycle of the grid, so that a snake of any
+length keeps moving until it fills the board, when the game starts again
+from the same position. Each workload is run --repeat times and the
+fastest run is kept.
+"""
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Renderers draw without a window
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+from plugins.snake_env import SnakeEnv # pylint: disable=wrong-import-position
+
+GRID_SIZES = [4, 10, 40, 100]
+SNAKE_FILLS = {'short': 0.0, 'half': 0.5, 'full': 0.9} # Part of the board covered by the snake
+GROUPS = ['env', 'spawn', 'render', 'recorder']
+_DIRECTIONS = {(-1, 0): 'u', (1, 0): 'd', (0, -1): 'l', (0, 1): 'r'}
+_TURN_LEFT = {'u': 'l', 'l': 'd', 'd': 'r', 'r': 'u'}
+
+def hamiltonian_cycle(grid_size):
+    """Cells of a cycle through every cell of a grid of even size."""
+    cells = [(0, x) for x in range(grid_size)]
+    for y in range(1, grid_size):
+        xs = range(grid_size - 1, 0, -1) if y % 2 else range(1, grid_size)
+        cells.extend((y, x) for x in xs)
+    cells.extend((y, 0) for y in range(grid_size - 1, 0, -1))
+    return cells
+
+class CyclePlayer:
+    """Plays a SnakeEnv along a Hamiltonian cycle, starting with a snake
+    covering fill of the board, or with its usual length for 0."""
+    def __init__(self, grid_size, fill, seed=1):
+        self.env = env = SnakeEnv(grid_size=grid_size, seed=seed)
+        cycle = hamiltonian_cycle(grid_size)
+        self.next_dir = {cell: _DIRECTIONS[(nxt[0] - cell[0], nxt[1] - cell[1])]
+                         for cell, nxt in zip(cycle, cycle[1:] + cycle[:1])}
+        length = max(int(fill * env.arena_length), env.snake_length)
+        snake = cycle[length - 1::-1]
+        occupied = {y * grid_size + x for y, x in snake}
+        free = [cell for cell in range(env.arena_length) if cell not in occupied]
+        apple = divmod(free[env.rng.randint(len(free))], grid_size)
+        self.snapshot = {
+            'snake': snake,
+            'curr_dir': self.next_dir[snake[1]],
+            'extend': 0,
+            'snake_length': length,
+            'step_index': 0,
+            'apple': apple,
+            'rng': env.rng.get_state(),
+            'free': (np.array(free + sorted(occupied), dtype=np.int32), len(free))
+        }
+        self.restart()
+
+    def restart(self):
+        self.env.restore(self.snapshot)
+        return self.env.normalize_state()
+
+    def action(self):
+        env = self.env
+        direction = self.next_dir[env.snake[0]]
+        if direction == env.curr_dir:
+            return 0
+        return 1 if _TURN_LEFT[env.curr_dir] == direction else 2
+
+    def step(self):
+        """Steps the env, starting again once the board is full."""
+        state, reward, done, _info = self.env.step(self.action())
+        if done:
+            state = self.restart()
+        return state, reward, done
+
+@contextlib.contextmanager
+def gc_paused():
+    """Keeps garbage collection out of timings, as timeit does."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def best_of(repeat, run):
+    """Fastest of repeat calls of run, which returns the seconds it took."""
+    with gc_paused():
+        return min(run() for _ in range(repeat))
+
+def metric(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+def bench_env(results, repeat, steps):
+    for grid_size in GRID_SIZES:
+        for regime, fill in SNAKE_FILLS.items():
+            player = CyclePlayer(grid_size, fill)
+            def run():
+                player.restart()
+                start = time.perf_counter()
+                for _ in range(steps):
+                    player.step()
+                return time.perf_counter() - start
+            results[f'env.step/grid{grid_size}/{regime}'] = \
+                metric(steps / best_of(repeat, run), 'steps/s', 'higher')
+        env = SnakeEnv(grid_size=grid_size, seed=1)
+        def run_normalize():
+            start = time.perf_counter()
+            for _ in range(steps):
+                env.normalize_state()
+            return time.perf_counter() - start
+        results[f'env.normalize_state/grid{grid_size}'] = \
+            metric(best_of(repeat, run_normalize) / steps * 1e6, 'us', 'lower')
+
+def bench_spawn(results, repeat, spawns):
+    for fill in [0.9, 0.99]:
+        for legacy in [False, True]:
+            player = CyclePlayer(40, fill)
+            env = player.env
+            env.legacy_spawn = legacy
+            observation = env.normalize_state()
+            def run():
+                start = time.perf_counter()
+                for _ in range(spawns):
+                    env.spawn_apple(observation)
+                return time.perf_counter() - start
+            name = 'legacy_spawn' if legacy else 'spawn_apple'
+            results[f'env.{name}/grid40/fill{fill:g}'] = \
+                metric(best_of(repeat, run) / spawns * 1e6, 'us', 'lower')
+
+def bench_render(results, repeat, frames):
+    from plugins.pg_renderer import PgRenderer
+    from plugins.pg_sprite_renderer import PgSpriteRenderer
+    info = {'dead': False, 'is_playback': False}
+    for renderer_class, name in [(PgRenderer, 'pg_renderer'), (PgSpriteRenderer, 'pg_sprite_renderer')]:
+        for grid_size in [10, 40]:
+            player = CyclePlayer(grid_size, 0.5)
+            renderer = renderer_class(player.env)
+            runs = []
+            for _ in range(repeat):
+                times = np.zeros(frames)
+                state = player.restart()
+                with gc_paused():
+                    for i in range(frames):
+                        start = time.perf_counter()
+                        renderer.render(state, player.env, 0, info)
+                        times[i] = time.perf_counter() - start
+                        state, _reward, _done = player.step()
+                runs.append(times)
+            best = min(runs, key=np.sum)
+            results[f'render.{name}/grid{grid_size}/mean'] = metric(best.mean() * 1000, 'ms', 'lower')
+            results[f'render.{name}/grid{grid_size}/p95'] = \
+                metric(np.percentile(best, 95) * 1000, 'ms', 'lower')
+
+@contextlib.contextmanager
+def in_temp_dir():
+    """Runs in an empty directory with a recordings directory."""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.mkdir(os.path.join(tmp, 'recordings'))
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+def bench_recorder(results, repeat, steps):
+    from plugins.memory_recorder import MemoryRecorder
+    from plugins.memory_playback import MemoryPlayback
+    player = CyclePlayer(40, 0.1)
+    transitions = []
+    player.restart()
+    for _ in range(steps):
+        state, reward, done = player.step()
+        transitions.append((state, reward, done, player.env.curr_dir, 0))
+    with in_temp_dir():
+        def run_record():
+            recorder = MemoryRecorder('benchmark', 1)
+            start = time.perf_counter()
+            for transition in transitions:
+                recorder.run(*transition)
+            recorder.close()
+            return time.perf_counter() - start
+        results['recorder.write/grid40'] = \
+            metric(steps / best_of(repeat, run_record), 'steps/s', 'higher')
+
+        def run_load():
+            # Without the index, which is saved on first use
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join('recordings', 'benchmark.idx'))
+            start = time.perf_counter()
+            MemoryPlayback('benchmark')
+            return time.perf_counter() - start
+        results['playback.load/grid40'] = metric(best_of(repeat, run_load) * 1000, 'ms', 'lower')
+
+        def run_index():
+            playback = MemoryPlayback('benchmark')
+            start = time.perf_counter()
+            playback.seek(steps // 2)
+            elapsed = time.perf_counter() - start
+            os.remove(os.path.join('recordings', 'benchmark.idx'))
+            return elapsed
+        results['playback.first_seek/grid40'] = metric(best_of(repeat, run_index) * 1000, 'ms', 'lower')
+
+        def run_playback():
+            playback = MemoryPlayback('benchmark')
+            start = time.perf_counter()
+            for _ in range(steps - 1):
+                playback.step(0)
+            return time.perf_counter() - start
+        results['playback.step/grid40'] = \
+            metric((steps - 1) / best_of(repeat, run_playback), 'steps/s', 'higher')
+
+def run_suite(groups, repeat, scale=1.0):
+    results = {}
+    if 'env' in groups:
+        bench_env(results, repeat, int(20_000 * scale))
+    if 'spawn' in groups:
+        bench_spawn(results, repeat, int(20_000 * scale))
+    if 'render' in groups:
+        bench_render(results, repeat, int(500 * scale))
+    if 'recorder' in groups:
+        bench_recorder(results, repeat, int(20_000 * scale))
+    return results
+
+def environment():
+    import pygame
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pygame': pygame.version.ver,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+
+def compare(results, baseline, threshold):
+    """Prints the change of each metric against the baseline and returns the
+    names of those worse by more than threshold."""
+    regressions = []
+    print(f"{'metric':<44}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, current in results.items():
+        base = baseline.get(name)
+        if base is None or not base['value']:
+            print(f"{name:<44}{'':>12}{current['value']:>12.3f}{'new':>9}")
+            continue
+        change = current['value'] / base['value'] - 1
+        worse = -change if current['better'] == 'higher' else change
+        flag = ''
+        if worse > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<44}{base['value']:>12.3f}{current['value']:>12.3f}{change:>+9.1%}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark suite')
+    parser.add_argument('--only', nargs='+', choices=GROUPS, default=GROUPS, help='Groups of benchmarks run. Default: all')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs of each workload, of which the fastest is kept. Default: 5')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplies the steps of every workload. Default: 1')
+    parser.add_argument('--save', metavar='FILENAME', help='Save results as JSON')
+    parser.add_argument('--results', metavar='FILENAME', help='Load results saved by --save instead of running the benchmarks')
+    parser.add_argument('--compare', metavar='BASELINE', help='Compare with results saved by --save, exiting with status 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change counted as a regression. Default: 0.1')
+    args = parser.parse_args()
+    if args.results:
+        with open(args.results) as f:
+            report = json.load(f)
+    else:
+        report = {'environment': environment(), 'results': run_suite(args.only, args.repeat, args.scale)}
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report['results'], baseline['results'], args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regressions above {args.threshold:.0%}')
+            sys.exit(1)
+    else:
+        for name, result in report['results'].items():
+            print(f"{name:<44}{result['value']:>14,.3f} {result['unit']}")
@@ -0,0 +1,58 @@
+"""Compares env steps/sec of the vector envs available for training.
+
+Run from the repository root:
+    python -m benchmarks.vec_env --num_envs 32 --grid_size 40
+"""
+
+import argparse
+import time
+import numpy as np
+from stable_baselines.common.vec_env import DummyVecEnv, SubprocVecEnv
+from plugins.snake_env import SnakeEnv
+from plugins.subproc_snake_env import SubprocSnakeEnv
+from plugins.vec_snake_env import VecSnakeEnv
+
+def make_env(grid_size, seed):
+    def _init():
+        return SnakeEnv(grid_size=grid_size, seed=seed)
+    return _init
+
+def build_envs(args):
+    """Returns (name, constructor) pairs of the envs being compared."""
+    n, grid = args.num_envs, args.grid_size
+    envs = [
+        ('DummyVecEnv', lambda: DummyVecEnv([make_env(grid, i + 1) for i in range(n)])),
+        ('SubprocVecEnv', lambda: SubprocVecEnv([make_env(grid, i + 1) for i in range(n)])),
+        ('VecSnakeEnv', lambda: VecSnakeEnv(n, grid_size=grid, seed=1)),
+    ]
+    for workers in args.workers:
+        envs.append((f'SubprocSnakeEnv[{workers}]',
+                     lambda w=workers: SubprocSnakeEnv(n, grid_size=grid, seed=1, num_workers=w)))
+    return envs
+
+def measure(env, actions):
+    env.reset()
+    env.step(actions[0]) # Warm up
+    start = time.perf_counter()
+    for action in actions:
+        env.step(action)
+    elapsed = time.perf_counter() - start
+    return actions.size / elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Vector env throughput benchmark')
+    parser.add_argument('--num_envs', type=int, default=32)
+    parser.add_argument('--grid_size', type=int, default=40)
+    parser.add_argument('--steps', type=int, default=2000, help='Steps per env')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='Worker counts tried for SubprocSnakeEnv')
+    args = parser.parse_args()
+    rng = np.random.RandomState(0)
+    all_actions = rng.randint(3, size=(args.steps, args.num_envs))
+    for name, build in build_envs(args):
+        vec_env = build()
+        try:
+            rate = measure(vec_env, all_actions)
+        finally:
+            vec_env.close()
+        print(f'{name:>22}: {rate:12,.0f} steps/s')
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+"""Converts pickle recordings made by earlier versions of MemoryRecorder
+into the binary recording format.
+"""
+import argparse
+import os
+from os import path
+from plugins.recording_format import convert_pickle_recording, is_binary_recording
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert pickle recordings to the binary format')
+    parser.add_argument('filenames', nargs='+', metavar='FILENAME', help='Recordings in the recordings directory')
+    parser.add_argument('--suffix', default='', help='Appended to converted file names. Default: empty, which converts in place')
+    parser.add_argument('--seed', type=int, help='Environment seed stored in the header, if known')
+    args = parser.parse_args()
+    for name in args.filenames:
+        src = path.join('recordings', name)
+        if is_binary_recording(src):
+            print(f'{name}: already binary, skipping')
+            continue
+        dst = src + args.suffix
+        tmp = dst + '.tmp'
+        steps = convert_pickle_recording(src, tmp, seed=args.seed)
+        os.replace(tmp, dst)
+        print(f'{name}: {steps} steps, {path.getsize(dst)} bytes')
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""Evaluates a controller over many seeded games, played without display
+in a pool of processes, each loading the controller once.
+
+    ./evaluate.py sb:ppo2 ppo2_model1.npz --grid_size 4 --episodes 1000
+
+Game i is played with seed --seed + i, so two models evaluated with the
+same options face the same apples. Exported .npz policies sample their
+actions from the same seed, while PPO2 zip models, whose TensorFlow
+sampling can't be reseeded, play their most likely action.
+"""
+import argparse
+from collections import Counter
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+
+from game import load_controller, call_if_exists, positive_int
+from plugins.snake_env import SnakeEnv
+
+PERCENTILES = [5, 25, 75, 95]
+Z_95 = 1.96 # Normal quantile of a two-sided 95% interval
+BOOTSTRAP_RESAMPLES = 2000
+
+# Controller and env of a pool worker, set up once by _init_worker
+_worker = {}
+
+def _init_worker(controller, grid_size, max_steps):
+    _worker['controller'] = load_controller(controller[0], controller[1:])
+    _worker['env'] = SnakeEnv(grid_size=grid_size)
+    _worker['max_steps'] = max_steps
+
+def death_cause(env, done):
+    """Why a game ended: 'wall', 'body', 'board_full' when the snake filled
+    the grid, or 'max_steps' when it was still alive."""
+    if not done:
+        return 'max_steps'
+    y, x = env.snake[0]
+    if not (0 <= y < env.grid_size and 0 <= x < env.grid_size):
+        return 'wall'
+    if env.snake_length > env.arena_length:
+        return 'board_full'
+    return 'body'
+
+def play_episode(seed):
+    """Plays a game of the worker's controller from seed. The score is the
+    sum of rewards, as in game.py."""
+    env = _worker['env']
+    controller = _worker['controller']
+    env.seed(seed)
+    call_if_exists(controller, 'seed', [seed])
+    state = env.reset()
+    score = 0
+    length = 0
+    done = False
+    while not done and length != _worker['max_steps']:
+        action = controller.get_action(state, env.curr_dir, poll_events=False)
+        state, reward, done, _info = env.step(action)
+        score += reward
+        length += 1
+    return {'seed': seed, 'score': score, 'length': length, 'death': death_cause(env, done)}
+
+def bootstrap_median_ci(values, rng, resamples=BOOTSTRAP_RESAMPLES):
+    """95% percentile bootstrap interval of the median."""
+    medians = np.empty(resamples)
+    # Resampled in batches, to bound memory on many episodes
+    batch = max(1, 1_000_000 // len(values))
+    for i in range(0, resamples, batch):
+        n = min(batch, resamples - i)
+        medians[i:i + n] = np.median(rng.choice(values, size=(n, len(values))), axis=1)
+    return np.percentile(medians, [2.5, 97.5]).tolist()
+
+def summarize(values, rng):
+    """Mean and median with their 95% confidence intervals, spread and
+    percentiles of the values of all episodes."""
+    values = np.asarray(values, dtype=float)
+    std = values.std(ddof=1) if len(values) > 1 else 0.0
+    half_width = Z_95 * std / np.sqrt(len(values))
+    summary = {
+        'mean': values.mean(),
+        'mean_ci': [values.mean() - half_width, values.mean() + half_width],
+        'median': np.median(values),
+        'median_ci': bootstrap_median_ci(values, rng),
+        'std': std,
+        'min': values.min(),
+        'max': values.max()
+    }
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f'p{q}'] = value
+    return {name: np.asarray(value).tolist() for name, value in summary.items()}
+
+def evaluate(controller, episodes, grid_size=40, seed=0, workers=1, max_steps=10_000):
+    """Plays episodes games with seeds seed, seed + 1, ... and returns their
+    results in that order."""
+    seeds = range(seed, seed + episodes)
+    pool = mp.Pool(workers, initializer=_init_worker, initargs=(controller, grid_size, max_steps))
+    try:
+        results = list(pool.imap(play_episode, seeds, chunksize=max(1, episodes // (workers * 8))))
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+def print_summary(summary):
+    for name in ['score', 'length']:
+        s = summary[name]
+        print(f"{name:<7} mean {s['mean']:.2f} (95% CI {s['mean_ci'][0]:.2f} to {s['mean_ci'][1]:.2f}), "
+              f"median {s['median']:g} (95% CI {s['median_ci'][0]:g} to {s['median_ci'][1]:g}), std {s['std']:.2f}")
+        print(f"{'':<7} min {s['min']:g}, " + ', '.join(f"p{q} {s[f'p{q}']:g}" for q in PERCENTILES)
+              + f", max {s['max']:g}")
+    episodes = sum(summary['deaths'].values())
+    print('deaths  ' + ', '.join(f'{cause} {count} ({count / episodes:.1%})'
+                                 for cause, count in summary['deaths'].items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate a controller over seeded games')
+    parser.add_argument('controller', nargs='+', help='Controller and its arguments, as the --controller option of game.py (e.g. sb:ppo2 ppo2_model1.npz)')
+    parser.add_argument('--episodes', type=positive_int, default=1000, help='Number of games. Default: 1000')
+    parser.add_argument('--grid_size', type=int, default=40, help='Size of a side in the square snake grid. Default: 40')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game, incremented for each next one. Actions of exported .npz policies are sampled from it too, while PPO2 zip models play their most likely action. Default: 0')
+    parser.add_argument('--max_steps', type=positive_int, default=10_000, help='Maximum steps of a game. Default: 10000')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Games played in parallel. Default: number of cores')
+    parser.add_argument('--json', metavar='FILENAME', help='Save the summary and the result of every game as JSON')
+    args = parser.parse_args()
+    if args.controller[0] == 'user':
+        raise SystemExit('The user controller needs a display, use game.py to play')
+    start = time.perf_counter()
+    results = evaluate(args.controller, args.episodes, args.grid_size, args.seed,
+                       min(args.workers, args.episodes) or 1, args.max_steps)
+    elapsed = time.perf_counter() - start
+    steps = sum(result['length'] for result in results)
+    rng = np.random.RandomState(args.seed)
+    summary = {
+        'score': summarize([result['score'] for result in results], rng),
+        'length': summarize([result['length'] for result in results], rng),
+        'deaths': dict(Counter(result['death'] for result in results).most_common())
+    }
+    print(f'{args.episodes} games, {steps} steps in {elapsed:.2f}s '
+          f'({args.episodes / elapsed:.0f} games/s, {steps / elapsed:.0f} steps/s)')
+    print_summary(summary)
+    if args.json:
+        report = {
+            'controller': args.controller,
+            'grid_size': args.grid_size,
+            'seed': args.seed,
+            'max_steps': args.max_steps,
+            'summary': summary,
+            'episodes': results
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
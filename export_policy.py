@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Exports the policy of a PPO2 MlpPolicy model to an .npz file, which
+Ppo2Controller runs in NumPy (e.g. ./game.py --controller sb:ppo2 ppo2_model1.npz).
+"""
+import argparse
+import time
+from os import path
+import numpy as np
+from plugins.stable_baselines.mlp_policy import export_mlp_policy, NumpyMlpPolicy
+
+def check_parity(model_path, policy, num_obs, seed=0):
+    """Compares the NumPy policy with PPO2 on random observations, returning
+    the largest probability difference and the number of deterministic
+    actions that differ."""
+    from stable_baselines import PPO2
+    model = PPO2.load(model_path)
+    rng = np.random.RandomState(seed)
+    shape = model.observation_space.shape
+    observations = rng.randint(4, size=(num_obs, *shape)).astype(np.uint8)
+    max_diff = 0.0
+    mismatches = 0
+    for obs in observations:
+        expected = model.action_probability(obs)
+        max_diff = max(max_diff, float(np.abs(policy.action_probability(obs) - expected).max()))
+        action, _states = model.predict(obs, deterministic=True)
+        mismatches += int(policy.predict(obs, deterministic=True)[0] != action)
+    return max_diff, mismatches
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a PPO2 MlpPolicy to NumPy arrays')
+    parser.add_argument('model', metavar='MODEL', help='Model file in the models directory, e.g. ppo2_model1.zip')
+    parser.add_argument('--check', type=int, default=0, metavar='N', help='Compare with PPO2 on N random observations (needs stable_baselines)')
+    args = parser.parse_args()
+    model_path = path.join('models', args.model)
+    if not model_path.endswith('.zip'):
+        model_path += '.zip'
+    npz_path = path.splitext(model_path)[0] + '.npz'
+    arrays = export_mlp_policy(model_path, npz_path)
+    print(f'{npz_path}: {len(arrays)} arrays, {path.getsize(npz_path)} bytes')
+
+    start = time.perf_counter()
+    policy = NumpyMlpPolicy.load(npz_path)
+    load_time = time.perf_counter() - start
+    obs = np.zeros(policy.input.size, dtype=np.uint8)
+    policy.predict(obs)
+    start = time.perf_counter()
+    for _ in range(1000):
+        policy.predict(obs)
+    predict_time = (time.perf_counter() - start) / 1000
+    print(f'load: {load_time * 1000:.2f} ms, predict: {predict_time * 1e6:.1f} us')
+
+    if args.check:
+        max_diff, mismatches = check_parity(model_path, policy, args.check)
+        print(f'parity on {args.check} observations: max probability difference {max_diff:.2e}, '
+              f'{mismatches} deterministic actions differ')
+        if max_diff > 1e-4 or mismatches:
+            raise SystemExit('NumPy policy does not match PPO2')
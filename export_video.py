@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""Exports recordings to video clips or frame files, drawn by the game
+renderers without a window and as fast as they draw.
+"""
+import argparse
+import importlib
+import multiprocessing as mp
+import os
+from os import path
+import shutil
+import subprocess
+import time
+
+# Renderers open their display on the dummy driver, in every worker
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+# SDL would otherwise catch the SIGTERM that stops pool workers on errors
+os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import pygame as pg # pylint: disable=wrong-import-position
+from plugins.memory_playback import MemoryPlayback # pylint: disable=wrong-import-position
+from plugins.recording_format import recording_kind # pylint: disable=wrong-import-position
+from game import get_class_name # pylint: disable=wrong-import-position
+
+RECORDINGS_DIR = 'recordings'
+DEATH_HOLD = 1.0 # Seconds the game over screen stays in the clip
+
+_PICKLE_PROTOCOL = b'\x80' # First byte of pickles of protocol 2 and later
+
+def is_recording(filename):
+    """Whether a file is a binary recording, an action log or a pickle
+    recording of earlier versions, rather than an index or any other file."""
+    if not path.isfile(filename) or path.basename(filename).startswith('.'):
+        return False
+    if recording_kind(filename) != 'pickle':
+        return True
+    with open(filename, 'rb') as f:
+        return f.read(1) == _PICKLE_PROTOCOL
+
+def list_recordings(directory=RECORDINGS_DIR):
+    """Recording files of a directory."""
+    return sorted(name for name in os.listdir(directory)
+                  if is_recording(path.join(directory, name)))
+
+class FfmpegWriter:
+    """Pipes raw RGB frames to ffmpeg, which encodes them as MP4 or GIF."""
+    def __init__(self, filename, size, fps, video_format):
+        if video_format == 'gif':
+            codec = ['-vf', 'split[a][b];[a]palettegen[p];[b][p]paletteuse']
+        else:
+            # yuv420p needs even dimensions, which odd grid sizes don't give
+            codec = ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+        command = ['ffmpeg', '-loglevel', 'error', '-y', '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                   '-s', f'{size[0]}x{size[1]}', '-r', str(fps), '-i', '-', *codec, filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, screen, count=1):
+        data = pg.image.tostring(screen, 'RGB')
+        for _ in range(count):
+            self.process.stdin.write(data)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f'ffmpeg failed with code {self.process.returncode}')
+
+class PngWriter:
+    """Saves each frame as a numbered PNG file in a directory."""
+    def __init__(self, dirname):
+        os.makedirs(dirname, exist_ok=True)
+        self.dirname = dirname
+        self.count = 0
+
+    def write(self, screen, count=1):
+        first = path.join(self.dirname, f'{self.count:06d}.png')
+        pg.image.save(screen, first)
+        # Repeated frames are copied rather than compressed again
+        for i in range(1, count):
+            shutil.copyfile(first, path.join(self.dirname, f'{self.count + i:06d}.png'))
+        self.count += count
+
+    def close(self):
+        pass
+
+def export_recording(name, renderer_name, video_format, fps, out_dir):
+    """Draws every step of a recording once, writing the frames to a clip or
+    frame directory named after it. Returns the name, the number of steps
+    and the time taken."""
+    start = time.perf_counter()
+    env = MemoryPlayback(name)
+    if renderer_name == 'pg_sprite_renderer' and not hasattr(env, 'snake'):
+        raise ValueError('pg_sprite_renderer needs a recording made with --record_mode actions')
+    module = importlib.import_module(f'plugins.{renderer_name}')
+    renderer = getattr(module, get_class_name(renderer_name))(env)
+    screen = renderer.screen
+    base = path.join(out_dir, name)
+    if video_format == 'png':
+        writer = PngWriter(base)
+    else:
+        writer = FfmpegWriter(f'{base}.{video_format}', screen.get_size(), fps, video_format)
+    hold = max(round(DEATH_HOLD * fps), 1)
+    info = {'dead': False, 'is_playback': False}
+    state = env.reset()
+    score = 0
+    try:
+        renderer.render(state, env, score, info)
+        writer.write(screen)
+        for _ in range(env.memory_len - 1):
+            state, reward, done, _info = env.step(0)
+            score += reward
+            info['dead'] = done
+            renderer.render(state, env, score, info)
+            writer.write(screen, hold if done else 1)
+            if done:
+                score = 0
+    finally:
+        writer.close()
+    return name, env.memory_len, time.perf_counter() - start
+
+def _export_job(job):
+    """Runs export_recording in a worker, returning the error message of a
+    recording that can't be exported instead of stopping the others."""
+    try:
+        return export_recording(*job), None
+    except (OSError, ValueError, SystemError, RuntimeError) as e:
+        return (job[0], 0, 0), str(e)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export recordings to video clips')
+    parser.add_argument('filenames', nargs='*', metavar='FILENAME', help='Recordings in the recordings directory. Default: all of them')
+    parser.add_argument('--format', choices=['mp4', 'gif', 'png'], default='mp4', help='Clip format, encoded by ffmpeg, or png for a directory of frame files. Default: mp4')
+    parser.add_argument('--renderer', default='pg_renderer', help='pg_renderer, or pg_sprite_renderer for recordings made with --record_mode actions. Default: pg_renderer')
+    parser.add_argument('--fps', type=int, default=10, help='Steps per second of video. Default: 10, as --speed 100')
+    parser.add_argument('--out', default='videos', help='Output directory. Default: videos')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Recordings exported in parallel. Default: number of cores')
+    args = parser.parse_args()
+    if args.format != 'png' and shutil.which('ffmpeg') is None:
+        raise SystemExit('ffmpeg was not found, use --format png to export frame files')
+    names = args.filenames or list_recordings()
+    os.makedirs(args.out, exist_ok=True)
+    start = time.perf_counter()
+    total_steps = 0
+    exported = 0
+    pool = mp.Pool(min(args.workers, len(names)) or 1)
+    jobs = [(name, args.renderer, args.format, args.fps, args.out) for name in names]
+    for (name, steps, elapsed), error in pool.imap_unordered(_export_job, jobs):
+        if error:
+            print(f'{name}: {error}')
+            continue
+        total_steps += steps
+        exported += 1
+        print(f'{name}: {steps} steps in {elapsed:.2f}s ({steps / elapsed:.0f} steps/s)')
+    # Workers exit on their own, rather than by a signal that SDL may catch
+    pool.close()
+    pool.join()
+    elapsed = time.perf_counter() - start
+    print(f'{exported} of {len(names)} recordings, {total_steps} steps in {elapsed:.2f}s')
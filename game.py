@@ -2,17 +2,19 @@
 """
 UI and user input logic that interacts with snake gym environment.
 """
-import pygame as pg
 import argparse
 import importlib
+import math
+import time
 from enum import Enum
 from operator import itemgetter
 from plugins.snake_env import SnakeEnv
-from plugins.memory_playback import MemoryPlayback
+from plugins import profiler
 
-CLOCK = pg.time.Clock()
-TARGET_FPS = 60 # Game update rate depends on speed parameter, not this.
-                # FPS should be high to handle quick input.
+TARGET_FPS = 60 # Most frames rendered per second, when the display refresh
+                # rate is unknown. Game update rate depends on speed parameter.
+MAX_LAG = 0.25 # Seconds of env steps caught up after late frames. Beyond
+               # this, the game slows down instead.
 
 def get_class_name(plugin_name):
     """Converts snake case plugin name into camel case class name.
@@ -28,12 +30,61 @@ def load_plugin(plugin_args):
     pclass = getattr(module, class_name)
     return pclass(*plugin_args[1:])
 
+def display_refresh_rate():
+    """Refresh rate of the display, or TARGET_FPS where pygame can't tell."""
+    import pygame as pg
+    get_rates = getattr(pg.display, 'get_desktop_refresh_rates', None)
+    if get_rates is not None and pg.display.get_init():
+        rates = [rate for rate in get_rates() if rate > 0]
+        if rates:
+            return min(rates)
+    return TARGET_FPS
+
+def wait_for_input(timeout):
+    """Sleeps until an input event arrives or timeout seconds pass, forever
+    if timeout is None. The event is left in the queue for the controller."""
+    import pygame as pg
+    if pg.event.peek():
+        return
+    if timeout is None:
+        event = pg.event.wait()
+    elif timeout > 0:
+        # Rounded up, as a shorter wait would return at once
+        timeout_ms = math.ceil(timeout * 1000)
+        if pg.version.vernum[0] < 2:
+            # pygame 1 can't wait on events with a timeout, so sleep in
+            # steps short enough to keep input responsive
+            pg.time.wait(min(timeout_ms, 1000 // TARGET_FPS))
+            return
+        event = pg.event.wait(timeout_ms)
+    else:
+        return
+    if event.type != pg.NOEVENT:
+        pg.event.post(event)
+
 def call_if_exists(obj, method_name, args = []):
     if hasattr(obj, method_name) and callable(getattr(obj, method_name)):
         method = getattr(obj, method_name)
         return method(*args)
     return None
 
+def positive_int(text):
+    """argparse type of counts that must be at least 1."""
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f'{text} is not a positive integer')
+    return value
+
+# Playback navigation, see MemoryPlayback
+SEEK_ACTIONS = {
+        'BACK': lambda env: env.step_back(),
+        'NEXT_APPLE': lambda env: env.next_event('apple'),
+        'NEXT_DEATH': lambda env: env.next_event('death')
+        }
+
+# Timed phases of the game loop, see plugins.profiler
+PHASES = ['events', 'controller', 'env.step', 'sound', 'aux', 'render', 'wait']
+
 PLUGINS_DICT = {
         'sound': None,
         'renderer': None,
@@ -44,9 +95,10 @@ class Game:
     def __init__(self, controller, env, speed, plugins):
         self.env = env
         self.controller = controller
-        self.update_every = round(speed/1000 * TARGET_FPS)
+        self.step_period = speed / 1000
         self.plugins = PLUGINS_DICT
         self.load_plugins(env, plugins)
+        self.timers = {phase: profiler.timer(phase) for phase in PHASES}
 
     def load_plugins(self, env, plugins):
         for p in plugins:
@@ -62,54 +114,143 @@ class Game:
                 self.plugins[plugin_type] = load_plugin([f'base_{plugin_type}'])
 
     def reset(self):
+        state = self.env.reset()
+        self.plugins['aux'].reset()
         return {
                 'game_over': False,
                 'dead': False,
                 'score': 0,
                 'action': 0, # Do nothing
-                'update_counter': self.update_every, # start counter ready to update
-                'state': self.env.reset()
+                'state': state
                }
 
     def run(self):
         """Start game.
+
+        Env steps follow a fixed timestep of speed ms, kept apart from
+        rendering: when frames are late, several steps are run before the
+        next frame, and when steps are shorter than a frame, only the last
+        one is drawn. Frames are drawn no faster than the display refresh,
+        and only when something changed, except for the blinking playback
+        label. In between, the loop sleeps until the next step or frame is
+        due or an input event arrives.
         """
-        game_over, dead, score, action, update_counter, state = itemgetter(
-            'game_over', 'dead', 'score', 'action', 'update_counter', 'state')(self.reset())
+        import pygame as pg # Only needed with a display, unlike run_headless
+        game_over, dead, score, action, state = itemgetter(
+            'game_over', 'dead', 'score', 'action', 'state')(self.reset())
         renderer = self.plugins['renderer']
         controller = self.controller
         is_playback = self.env.is_playback()
         sound = self.plugins['sound']
+        aux = self.plugins['aux']
+        timers = self.timers
+        frame_period = 1 / display_refresh_rate()
+        clock = pg.time.Clock()
+        next_step = next_frame = time.perf_counter()
+        changed = True
         while not game_over:
-            CLOCK.tick(60)
-            fps = CLOCK.get_fps()
-            renderer.set_caption(f"{fps:.2f} fps")
-            renderer.render(state, self.env, score,
-                            {'dead': dead, 'is_playback': is_playback})
-
-            new_action = controller.get_action(state, self.env.curr_dir)
+            now = time.perf_counter()
+            # Only input is handled here, the controller computes an action
+            # for each step below
+            with timers['events']:
+                new_action = controller.get_action(state, self.env.curr_dir, compute=False)
             action = new_action if new_action != 0 else action
             if action == 'QUIT':
                 game_over = True
                 continue
             elif action == 'CONTINUE' and is_playback:
-                dead = False
+                if dead:
+                    dead, changed, next_step = False, True, now
+                action = 0
             elif action == 'RESTART':
-                game_over, dead, score, action, update_counter, state = itemgetter(
-                    'game_over', 'dead', 'score', 'action', 'update_counter', 'state')(self.reset())
-                continue
-            if dead:
+                game_over, dead, score, action, state = itemgetter(
+                    'game_over', 'dead', 'score', 'action', 'state')(self.reset())
+                changed, next_step = True, now
                 continue
-            if update_counter >= self.update_every:
-                state, reward, dead, _info = self.env.step(action)
+            elif action in SEEK_ACTIONS and is_playback:
+                new_state = SEEK_ACTIONS[action](self.env)
+                if new_state is not None:
+                    state, score, dead = new_state, self.env.score(), False
+                    changed, next_step = True, now + self.step_period
+                action = 0
+
+            if not dead and now - next_step > MAX_LAG:
+                next_step = now
+            while not dead and next_step <= now:
+                if not is_playback:
+                    with timers['controller']:
+                        computed = controller.get_action(state, self.env.curr_dir, poll_events=False)
+                    action = computed if computed != 0 else action
+                with timers['env.step']:
+                    state, reward, dead, _info = self.env.step(action)
                 score += reward
                 if reward > 0:
-                    sound.play_eat()
-                self.plugins['aux'].run(state, reward, dead, self.env.curr_dir, action)
-                update_counter = 0
+                    with timers['sound']:
+                        sound.play_eat()
+                with timers['aux']:
+                    aux.run(state, reward, dead, self.env.curr_dir, action)
                 action = 0 # Do nothing
-            else:
-                update_counter += 1
+                next_step += self.step_period
+                changed = True
+                if time.perf_counter() - now > frame_period:
+                    break # Draw a frame before catching up further
+
+            now = time.perf_counter()
+            if (changed or is_playback) and now >= next_frame:
+                clock.tick()
+                renderer.set_caption(f"{clock.get_fps():.2f} fps")
+                with timers['render']:
+                    renderer.render(state, self.env, score,
+                                    {'dead': dead, 'is_playback': is_playback})
+                changed = False
+                next_frame = max(next_frame + frame_period, now)
+
+            deadlines = []
+            if not dead:
+                deadlines.append(next_step)
+            if changed or is_playback:
+                deadlines.append(next_frame)
+            with timers['wait']:
+                wait_for_input(min(deadlines) - time.perf_counter() if deadlines else None)
+        self.close()
+
+    def run_headless(self, num_games=1, max_steps=None):
+        """Plays games back to back as fast as the controller answers, without
+        display, input handling or frame pacing. Aux plugins still run on
+        every step. A game also ends after max_steps, if given.
+        Prints and returns the score of each game.
+        """
+        env = self.env
+        controller = self.controller
+        aux = self.plugins['aux']
+        timers = self.timers
+        scores = []
+        steps = 0
+        start = time.perf_counter()
+        for _ in range(num_games):
+            state = env.reset()
+            aux.reset()
+            score = 0
+            dead = False
+            game_steps = 0
+            while not dead and game_steps != max_steps:
+                with timers['controller']:
+                    action = controller.get_action(state, env.curr_dir, poll_events=False)
+                with timers['env.step']:
+                    state, reward, dead, _info = env.step(action)
+                score += reward
+                with timers['aux']:
+                    aux.run(state, reward, dead, env.curr_dir, action)
+                game_steps += 1
+            steps += game_steps
+            scores.append(score)
+        elapsed = time.perf_counter() - start
+        self.close()
+        print(f'{num_games} games, {steps} steps in {elapsed:.2f}s '
+              f'({steps / elapsed:.0f} steps/s), mean score {sum(scores) / num_games:.2f}')
+        return scores
+
+    def close(self):
         for p in self.plugins.values():
             call_if_exists(p, 'close')
 
@@ -134,25 +275,43 @@ if __name__ == '__main__':
     parser.add_argument('--controller', action='store', nargs='+', default=['user'], help='Input handler. To have a trained AI model play, use sb:ppo2 <model file path> (e.g. ./game.py --controller sb:ppo2 ppo2_model1). The trained model is expected to be in the models directory. The controller sb:ppo2 uses a plugin that wraps stable_baselines and uses the PPO2 algorithm. Default: user (keyboard controlled)')
     parser.add_argument('--playback', action='store', metavar='FILENAME')
     parser.add_argument('--renderer', action='store', default='pg_renderer', metavar='RENDERER', help='Render mode. Either pg_renderer or pg_sprite_renderer for sprite-based graphics. Default: pg_renderer')
-    parser.add_argument('--speed', type=int, default=100, help='Game update period in ms. Default: 100')
+    parser.add_argument('--speed', type=float, default=100, help='Game update period in ms, which can be shorter than a frame. Default: 100')
     parser.add_argument('--seed', type=int, help='Integer seed for environment RNG')
+    parser.add_argument('--legacy_spawn', action='store_true', help='Place apples as in earlier versions, to reproduce their games for a given seed')
     parser.add_argument('--grid_size', type=int, default=40, help='Size of a side in the square snake grid')
     parser.add_argument('--sound', choices=['on', 'off'], default='on')
     parser.add_argument('--record', metavar='FILENAME')
+    parser.add_argument('--record_mode', choices=['frames', 'actions'], default='frames', help='Record every frame, or only the seed and actions, from which playback runs the game again (about 1 byte per step). Default: frames')
+    parser.add_argument('--record_policy', choices=['block', 'drop', 'spill'], default='block', help='What the recorder does when disk writes fall behind: block the game, drop steps or write from the game loop. Default: block')
+    parser.add_argument('--headless', '--turbo', action='store_true', help='Play without display, sound or frame pacing, as fast as the controller answers, and report steps/sec')
+    parser.add_argument('--games', type=positive_int, default=1, help='Number of games played back to back in headless mode. Default: 1')
+    parser.add_argument('--profile', nargs='?', const='profile.json', metavar='FILENAME', help='Time each phase of the game loop, printing percentiles at exit and saving them as JSON. Default file: profile.json')
+    parser.add_argument('--max_steps', type=positive_int, default=10_000, help='Maximum steps of a game in headless mode. Default: 10000')
     args = parser.parse_args()
+    prof = profiler.enable() if args.profile else None
     controller = load_controller(args.controller[0], args.controller[1:])
     if args.playback:
+        from plugins.memory_playback import MemoryPlayback
         arg_env = MemoryPlayback(args.playback)
     else:
-        arg_env = SnakeEnv(grid_size=args.grid_size, seed=args.seed)
-    pls = [
-        [args.renderer, arg_env]
-    ]
-    if args.sound == 'on':
-        pls.append(['sound'])
-    if args.record:
-        pls.append(['memory_recorder', args.record])
+        arg_env = SnakeEnv(grid_size=args.grid_size, seed=args.seed,
+                           legacy_spawn=args.legacy_spawn)
+    pls = []
+    if not args.headless:
+        pls.append([args.renderer, arg_env])
+        if args.sound == 'on':
+            pls.append(['sound'])
+    if args.record and args.record_mode == 'actions':
+        pls.append(['action_recorder', args.record, arg_env])
+    elif args.record:
+        pls.append(['memory_recorder', args.record, args.seed, args.record_policy])
     game = Game(controller, arg_env, args.speed, pls)
-    game.run()
+    if args.headless:
+        game.run_headless(args.games, args.max_steps)
+    else:
+        game.run()
+    if prof:
+        prof.print_report()
+        prof.save(args.profile)
 
 
@@ -0,0 +1,32 @@
+"""Records the actions of a game, from which it can be simulated again.
+"""
+
+from os import path
+from plugins.base_aux import BaseAux
+from plugins.recording_format import action_log_header, RESET_EVENT
+
+class ActionRecorder(BaseAux):
+    """Records the SnakeEnv parameters, its seed and every action into an
+    action log, which MemoryPlayback plays back by running the game again.
+    It takes about one byte per step.
+
+    The recorder must be created before the env is first reset or stepped,
+    since playback starts from a new env with the same seed.
+    """
+    def __init__(self, filename, env):
+        BaseAux.__init__(self)
+        if not hasattr(env, 'rng_seed'):
+            raise SystemExit('Actions can only be recorded from a SnakeEnv')
+        self.filename = path.join('recordings', filename)
+        self.file = open(self.filename, 'wb')
+        self.file.write(action_log_header(env.grid_size, env.rng_seed, env.legacy_spawn))
+
+    def reset(self):
+        self.file.write(bytes((RESET_EVENT,)))
+
+    def run(self, state, reward, done, curr_dir, action):
+        # Anything but a turn leaves the snake going straight
+        self.file.write(bytes((action if action in (1, 2) else 0,)))
+
+    def close(self):
+        self.file.close()
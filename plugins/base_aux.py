@@ -8,6 +8,10 @@ class BaseAux:
     def types(self):
         return ['aux']
 
+    def reset(self):
+        """Called after the env is reset."""
+        pass
+
     def run(self, state, reward, done, curr_dir, action):
         pass
 
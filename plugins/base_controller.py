@@ -1,16 +1,20 @@
 """Handles input that is always applied to game (e.g. QUIT command)
 """
 
-import pygame as pg
-
 class BaseController:
     def __init__(self, *args):
         pass
 
-    def get_action(self, state, curr_dir):
+    def get_action(self, state, curr_dir, poll_events=True, compute=True):
         """Handles quit command; further processing needs to be implemented
-        in a subclass.
+        in a subclass. Without poll_events, only the computed action is
+        returned, which works without a display. Without compute, only
+        input events are handled and 0 is returned otherwise, so that a
+        model is not queried on frames where the env does not step.
         """
+        if not poll_events:
+            return self._computed_action(state, curr_dir)
+        import pygame as pg # Not needed, nor imported, by headless games
         for event in pg.event.get():
             if event.type == pg.QUIT:
                 return 'QUIT'
@@ -23,7 +27,15 @@ class BaseController:
                     return 'CONTINUE'
                 elif event.key == pg.K_r:
                     return 'RESTART'
+                elif event.key == pg.K_BACKSPACE:
+                    return 'BACK'
+                elif event.key == pg.K_a:
+                    return 'NEXT_APPLE'
+                elif event.key == pg.K_d:
+                    return 'NEXT_DEATH'
                 return self._process(event.key, state, curr_dir)
+        if not compute:
+            return 0
         return self._computed_action(state, curr_dir)
 
     def types(self):
@@ -2,7 +2,7 @@
 """
 
 class BaseRenderer:
-    def __init__(self, env):
+    def __init__(self, *_args):
         pass
 
     def types(self):
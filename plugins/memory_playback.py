@@ -1,62 +1,346 @@
-import pickle
+import bisect
+import mmap
 from os import path
 import numpy as np
+from plugins.recording_format import RecordingReader, is_binary_recording, recording_kind, \
+    load_pickle_recording, read_action_log, INDEX_DTYPE, DONE_FLAG, KEYFRAME_FLAG, RESET_EVENT
+from plugins.snake_env import SnakeEnv
+
+_INDEX_SUFFIX = '.idx'
+_INDEX_END = 0xff # Flags of the last index entry, which holds the number of steps and file size
+CHECKPOINT_INTERVAL = 1000 # Steps between env snapshots of simulated playback
 
 
 def load_memory(filename):
+    """Loads every step of a recording, either in the binary format or
+    pickled by earlier versions of MemoryRecorder."""
     fullname = path.join('recordings', filename)
-    mem = []
-    with open(fullname, 'rb') as f:
-        while True:
+    if is_binary_recording(fullname):
+        with open(fullname, 'rb') as f:
+            return list(RecordingReader(f.read()))
+    return load_pickle_recording(fullname)
+
+def find_event(rewards, done_flags, start, kind):
+    """Returns the first step from start where the snake dies (kind 'death')
+    or eats an apple (kind 'apple'), or None."""
+    if kind == 'death':
+        hits = done_flags[start:]
+    elif kind == 'apple':
+        hits = rewards[start:] > 0
+    else:
+        raise ValueError(f'Unknown event kind: {kind}')
+    found = np.flatnonzero(hits)
+    if found.size == 0:
+        return None
+    return start + int(found[0])
+
+class MappedRecording:
+    """Binary recording decoded on demand from a memory-mapped file.
+
+    Playing forward only decodes the next record, so the first frames are
+    shown without reading the rest of the file. Going back, jumping ahead
+    and finding events use a sparse index of the keyframes, rewards and
+    deaths, which is built on first use and saved next to the recording.
+    Random access decodes from the closest keyframe before the step.
+    """
+    def __init__(self, fullname):
+        self.fullname = fullname
+        with open(fullname, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.reader = RecordingReader(self.data)
+        self._index = None
+        self._keyframes = None
+        self._length = None
+        self._flags = None
+        self._rewards = None
+        self.step_index = -1
+        self.next_offset = RecordingReader.FIRST_RECORD
+        self.current = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._length, self._index = self._load_index()
+            self._keyframes = self._index[(self._index['flags'] & KEYFRAME_FLAG) != 0]
+        return self._index
+
+    @property
+    def keyframes(self):
+        """Index entries of the steps stored as full grids."""
+        if self._index is None:
+            self.index # pylint: disable=pointless-statement
+        return self._keyframes
+
+    def _load_index(self):
+        idx_name = self.fullname + _INDEX_SUFFIX
+        if path.isfile(idx_name):
             try:
-               mem.append(pickle.load(f))
-            except EOFError:
-                break
-    return mem
+                saved = np.load(idx_name, mmap_mode='r')
+            except (OSError, ValueError):
+                saved = None
+            if saved is not None and saved.dtype == INDEX_DTYPE and saved.size > 0 \
+                    and saved[-1]['flags'] == _INDEX_END and saved[-1]['offset'] == len(self.data):
+                return int(saved[-1]['step']), saved[:-1]
+        length, index = self.reader.build_index()
+        end = np.array([(length, len(self.data), _INDEX_END, 0)], dtype=INDEX_DTYPE)
+        try:
+            with open(idx_name, 'wb') as f:
+                np.save(f, np.concatenate([index, end]))
+        except OSError:
+            pass # Read-only recordings directory, the index is rebuilt next time
+        return length, index
+
+    def __len__(self):
+        if self._index is None:
+            self.index # pylint: disable=pointless-statement
+        return self._length
+
+    def has_frame(self, step):
+        """Whether the recording holds a step. Only steps beyond the next
+        one need the index."""
+        if step == self.step_index + 1:
+            return self.reader.record_complete(self.next_offset)
+        if 0 <= step <= self.step_index:
+            return True
+        return 0 <= step < len(self)
+
+    def frame(self, step):
+        """Returns [state, reward, done, curr_dir, action] of a step."""
+        if step > self.step_index + 1 or step < self.step_index:
+            # Decode from the closest keyframe, unless it is behind the
+            # current step
+            keyframes = self.keyframes
+            keyframe = keyframes[np.searchsorted(keyframes['step'], step, side='right') - 1]
+            start = int(keyframe['step'])
+            if not start <= self.step_index < step:
+                self.step_index = start - 1
+                self.next_offset = int(keyframe['offset'])
+        grid = None if self.current is None else self.current[0]
+        while self.step_index < step:
+            self.next_offset, keyframe, values, payload = self.reader.record_at(self.next_offset)
+            grid = self.reader.apply(grid, keyframe, payload)
+            self.step_index += 1
+            self.current = [grid, *values]
+        return self.current
+
+    def _expand_index(self):
+        """Per-step flags and rewards, from the sparse index."""
+        if self._flags is None:
+            index = self.index
+            self._flags = np.zeros(len(self), dtype=np.uint8)
+            self._flags[index['step']] = index['flags']
+            self._rewards = np.zeros(len(self), dtype=np.int8)
+            self._rewards[index['step']] = index['reward']
+
+    def rewards(self):
+        self._expand_index()
+        return self._rewards
+
+    def events(self, flag):
+        self._expand_index()
+        return self._flags & flag
+
+    def find_event(self, start, kind):
+        return find_event(self.rewards(), self.events(DONE_FLAG), start, kind)
+
+class PickleRecording:
+    """Recording pickled by earlier versions of MemoryRecorder, which is
+    loaded as a whole."""
+    def __init__(self, fullname):
+        self.memory = load_pickle_recording(fullname)
+
+    def __len__(self):
+        return len(self.memory)
+
+    def has_frame(self, step):
+        return 0 <= step < len(self.memory)
+
+    def frame(self, step):
+        return self.memory[step]
+
+    def rewards(self):
+        return np.array([item[1] for item in self.memory])
+
+    def events(self, flag):
+        return np.array([DONE_FLAG if item[2] else 0 for item in self.memory]) & flag
+
+    def find_event(self, start, kind):
+        return find_event(self.rewards(), self.events(DONE_FLAG), start, kind)
+
+class SimulatedRecording:
+    """Action log, whose frames are rebuilt by running SnakeEnv again from
+    the recorded seed. A snapshot of the env is kept every
+    CHECKPOINT_INTERVAL steps, so going back only simulates again from the
+    closest one. Rewards and deaths are known up to the furthest step
+    simulated so far.
+    """
+    def __init__(self, fullname):
+        with open(fullname, 'rb') as f:
+            params, self.events_log = read_action_log(f.read())
+        self.env = SnakeEnv(**params)
+        # Position in the log of the event of each step
+        self.step_events = np.flatnonzero(self.events_log != RESET_EVENT)
+        self.next_event = 0
+        self.step_index = -1
+        self.current = None
+        self.seen_rewards = []
+        self.seen_dones = []
+        self.checkpoint_steps = []
+        self.checkpoints = []
+
+    def __len__(self):
+        return len(self.step_events)
+
+    def has_frame(self, step):
+        return 0 <= step < len(self)
+
+    def _simulate_step(self):
+        event = self.events_log[self.next_event]
+        while event == RESET_EVENT:
+            self.env.reset()
+            self.next_event += 1
+            event = self.events_log[self.next_event]
+        state, reward, done, _info = self.env.step(event)
+        self.next_event += 1
+        self.step_index += 1
+        self.current = [state, reward, done, self.env.curr_dir, int(event)]
+        if self.step_index == len(self.seen_rewards):
+            self.seen_rewards.append(reward)
+            self.seen_dones.append(done)
+            if self.step_index % CHECKPOINT_INTERVAL == 0:
+                self.checkpoint_steps.append(self.step_index)
+                self.checkpoints.append((self.next_event, self.current, self.env.snapshot()))
+
+    def frame(self, step):
+        """Returns [state, reward, done, curr_dir, action] of a step."""
+        if step == self.step_index:
+            return self.current
+        i = bisect.bisect_right(self.checkpoint_steps, step) - 1
+        if i >= 0 and (step < self.step_index or self.checkpoint_steps[i] > self.step_index):
+            self.next_event, self.current, snapshot = self.checkpoints[i]
+            self.step_index = self.checkpoint_steps[i]
+            self.env.restore(snapshot)
+        while self.step_index < step:
+            self._simulate_step()
+        return self.current
+
+    def rewards(self):
+        return np.array(self.seen_rewards)
+
+    def events(self, flag):
+        return np.array(self.seen_dones, dtype=np.uint8) * DONE_FLAG & flag
+
+    def find_event(self, start, kind):
+        found = find_event(self.rewards(), self.events(DONE_FLAG), start, kind)
+        step = len(self.seen_rewards)
+        while found is None and step < len(self):
+            _state, reward, done, _dir, _action = self.frame(step)
+            if (kind == 'death' and done) or (kind == 'apple' and reward > 0):
+                found = step
+            step += 1
+        return found
 
 class MemoryPlayback():
-    GRID_SIZE = 40
     APPLE_GRID_VAL = 3
     HEAD_GRID_VAL = 2
     COLL_GRID_VAL = 1
 
     def __init__(self, filename):
-        self.memory = load_memory(filename)
-        self.memory_len = len(self.memory)
-        if self.memory_len == 0:
-            raise SystemError("Nothing recorded in memory file {filename}")
-        self.curr_dir = self.memory[0][3]
-        self.grid_size = np.array(self.memory[0][0]).shape[0]
+        fullname = path.join('recordings', filename)
+        kind = recording_kind(fullname)
+        if kind == 'frames':
+            self.recording = MappedRecording(fullname)
+        elif kind == 'actions':
+            self.recording = SimulatedRecording(fullname)
+        else:
+            self.recording = PickleRecording(fullname)
+        if not self.recording.has_frame(0):
+            raise SystemError(f"Nothing recorded in memory file {filename}")
         self.offset = 0
+        self.state, _reward, _done, self.curr_dir, _action = self.recording.frame(0)
+        self.grid_size = np.array(self.state).shape[0]
+
+    @property
+    def memory_len(self):
+        return len(self.recording)
+
+    def _simulated_env(self):
+        if not isinstance(self.recording, SimulatedRecording):
+            raise AttributeError('Snake positions are only known when playing an action log')
+        # Searching for events may have simulated past the current step
+        self.recording.frame(self.offset)
+        return self.recording.env
+
+    @property
+    def snake(self):
+        """Snake of the current step, as in SnakeEnv, for renderers that
+        need it. Only action logs have it."""
+        return self._simulated_env().snake
+
+    @property
+    def apple(self):
+        return self._simulated_env().apple
+
+    @property
+    def step_index(self):
+        """Step of the recording being played, as counted by SnakeEnv."""
+        return self.offset
 
     def reset(self):
-        self.offset = 0
-        self.curr_dir = self.memory[0][3]
-        return self.memory[0][0]
+        return self.seek(0)
 
     def is_playback(self):
         return True
 
     def step(self, _action):
-        if self.offset >= self.memory_len - 1:
-            state = self.memory[self.offset][0]
-            return state, 0, True, None
+        if not self.recording.has_frame(self.offset + 1):
+            return self.state, 0, True, None
         self.offset += 1
-        state, reward, done, curr_dir, _rec_action = self.memory[self.offset]
-        self.curr_dir = curr_dir
-        return state, reward, done, None
+        self.state, reward, done, self.curr_dir, _rec_action = \
+            self.recording.frame(self.offset)
+        return self.state, reward, done, None
+
+    def seek(self, step):
+        """Moves playback to the given step, clamped to the recording, and
+        returns its state. The length of the recording is only needed past
+        its end."""
+        step = max(step, 0)
+        if not self.recording.has_frame(step):
+            step = len(self.recording) - 1
+        self.offset = step
+        self.state, _reward, _done, self.curr_dir, _action = \
+            self.recording.frame(self.offset)
+        return self.state
+
+    def step_back(self):
+        return self.seek(self.offset - 1)
+
+    def next_event(self, kind):
+        """Moves playback to the next step where the snake dies (kind 'death')
+        or eats an apple (kind 'apple'), returning its state, or None if
+        there is no such step left."""
+        step = self.recording.find_event(self.offset + 1, kind)
+        if step is None:
+            return None
+        return self.seek(step)
+
+    def score(self):
+        """Sum of rewards up to the current step, since the last death."""
+        deaths = np.flatnonzero(self.recording.events(DONE_FLAG)[:self.offset])
+        start = deaths[-1] + 1 if deaths.size else 0
+        return int(self.recording.rewards()[start:self.offset + 1].sum())
 
     def render(self, mode='human'):
-        norm_state = np.array(np.squeeze(self.memory[self.offset][0]))
-        full_grid = np.zeros((self.GRID_SIZE + 2, self.GRID_SIZE + 2))
+        norm_state = np.array(np.squeeze(self.state))
+        full_grid = np.zeros((self.grid_size + 2, self.grid_size + 2))
 
         # Add val elements
         full_grid[0,:] = self.COLL_GRID_VAL
-        full_grid[self.GRID_SIZE+1,:] = self.COLL_GRID_VAL
+        full_grid[self.grid_size+1,:] = self.COLL_GRID_VAL
         full_grid[:,0] = self.COLL_GRID_VAL
-        full_grid[:,self.GRID_SIZE+1] = self.COLL_GRID_VAL
+        full_grid[:,self.grid_size+1] = self.COLL_GRID_VAL
 
-        full_grid[1:(self.GRID_SIZE+1), 1:(self.GRID_SIZE+1)] = norm_state
+        full_grid[1:(self.grid_size+1), 1:(self.grid_size+1)] = norm_state
 
         size_y, size_x = full_grid.shape
         for y in range(size_y):
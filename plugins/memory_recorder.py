@@ -1,60 +1,158 @@
 """Records gameplay on a local file.
 """
 
-import pickle
+from collections import deque
 from os import path
-from queue import Empty, Queue
 import threading
 import time
 
 
+from plugins import profiler
 from plugins.base_aux import BaseAux
+from plugins.recording_format import RecordingEncoder
+
+MAX_QUEUE = 10_000 # Steps waiting to be written
+BATCH_SIZE = 256 # Steps that wake up the writer
+FLUSH_INTERVAL = 1.0 # Seconds a step can wait before being written
+POLICIES = ['block', 'drop', 'spill']
 
 class MemoryRecorder(BaseAux):
-    """Records gameplay into a file, which can
-    be played back with MemoryPlayback plugin."""
-    def __init__(self, filename):
+    """Records gameplay into a file in the binary format of
+    plugins.recording_format, which can be played back with
+    MemoryPlayback plugin.
+
+    Steps are queued and written by a background thread, see
+    RecordingWriter for what happens when the queue is full."""
+    def __init__(self, filename, seed=None, policy='block', max_queue=MAX_QUEUE):
         BaseAux.__init__(self)
-        self.memory = []
         fullname = path.join('recordings', filename)
         self.filename = fullname
-        with open(fullname, 'wb') as _f:
-            pass
-        self.queue = Queue()
-        self.quit = threading.Event() # Signals to thread when to stop
-        self.file_thread = threading.Thread(
-            name='file_flush',
-            target=_bg_run,
-            args=(self.quit, self.queue, self.filename))
-        self.file_thread.start()
+        self.seed = seed
+        self.encoder = None # Created on the first step, once grid size is known
+        self.writer = RecordingWriter(fullname, self._encode, policy, max_queue)
+
+    def _encode(self, item):
+        """Returns the bytes of a recorded step, preceded by the file header
+        on the first one."""
+        if self.encoder is None:
+            self.encoder = RecordingEncoder(item[0].shape[0], self.seed)
+            return self.encoder.header() + self.encoder.encode(*item)
+        return self.encoder.encode(*item)
 
     def run(self, state, reward, done, curr_dir, action):
         """Appends state to queue to be consumed by background thread.
         """
-        self.queue.put([state, reward, done, curr_dir, action])
+        self.writer.put([state, reward, done, curr_dir, action])
+
+    def stats(self):
+        return self.writer.stats()
 
     def close(self):
         """Signal bg thread to stop, pushing remaining states to file.
         """
-        self.quit.set()
-        self.file_thread.join()
-
-def _bg_run(quit_ev, memory, filename):
-    """Background thread polls queue for states to save,
-    and appends to a file. The poll is non-blocking, so
-    that the thread can get the signal to stop.
-    Once the signal arrives, it pushes all remaining states
-    from memory to the given file.
+        self.writer.close()
+
+class RecordingWriter:
+    """Writes items to a file from a background thread, keeping the file
+    open and turning each batch of items into a single write.
+
+    The thread sleeps on a condition until a batch of items is queued,
+    FLUSH_INTERVAL has passed or the writer is closed. At most max_queue
+    items wait in memory; when the queue is full, the policy decides what
+    happens to a new item:
+    - 'block': wait until the thread has taken the queued items.
+    - 'drop': discard it. Playback then skips that step.
+    - 'spill': write the whole queue from the calling thread.
     """
-    done = False
-    while not done:
-        try:
-            with open(filename, 'ab') as f:
-                while not memory.empty():
-                    item = memory.get(block=False)
-                    pickle.dump(item, f)
-        except Empty:
-            pass
-        done = quit_ev.is_set()
-        if not done:
-            time.sleep(1)
+    def __init__(self, filename, encode, policy='block', max_queue=MAX_QUEUE):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown recording policy {policy}, expected one of {POLICIES}')
+        self.encode = encode
+        self.policy = policy
+        self.max_queue = max_queue
+        self.batch_size = min(BATCH_SIZE, max_queue)
+        self.file = open(filename, 'wb')
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.write_lock = threading.Lock() # Keeps items in order when spilling
+        self.closing = False
+        self.write_timer = profiler.timer('recorder.write')
+        self.counters = {
+            'items_written': 0,
+            'items_dropped': 0,
+            'bytes_written': 0,
+            'batches': 0,
+            'max_queue_depth': 0,
+            'write_seconds': 0.0,
+            'max_write_seconds': 0.0
+        }
+        self.thread = threading.Thread(name='file_flush', target=self._run)
+        self.thread.start()
+
+    def put(self, item):
+        with self.cond:
+            if len(self.queue) >= self.max_queue:
+                if self.policy == 'drop':
+                    self.counters['items_dropped'] += 1
+                    return
+                if self.policy == 'block':
+                    self.cond.wait_for(lambda: len(self.queue) < self.max_queue)
+            self.queue.append(item)
+            depth = len(self.queue)
+            self.counters['max_queue_depth'] = max(self.counters['max_queue_depth'], depth)
+            if depth == self.batch_size:
+                self.cond.notify_all()
+        if depth >= self.max_queue and self.policy == 'spill':
+            self._write_queued()
+
+    def _take_batch(self):
+        with self.cond:
+            batch = list(self.queue)
+            self.queue.clear()
+            self.cond.notify_all() # Wakes blocked producers
+        return batch
+
+    def _write_queued(self):
+        with self.write_lock:
+            batch = self._take_batch()
+            if not batch:
+                return
+            data = b''.join(map(self.encode, batch))
+            start = time.perf_counter()
+            self.file.write(data)
+            self.file.flush()
+            elapsed = time.perf_counter() - start
+            self.write_timer.record(elapsed)
+        with self.cond:
+            counters = self.counters
+            counters['items_written'] += len(batch)
+            counters['bytes_written'] += len(data)
+            counters['batches'] += 1
+            counters['write_seconds'] += elapsed
+            counters['max_write_seconds'] = max(counters['max_write_seconds'], elapsed)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(
+                    lambda: self.closing or len(self.queue) >= self.batch_size, FLUSH_INTERVAL)
+                closing = self.closing
+            self._write_queued()
+            if closing:
+                break
+        self.file.close()
+
+    def stats(self):
+        """Returns the queue depth and write counters, with write latency in
+        seconds per batch."""
+        with self.cond:
+            stats = dict(self.counters, queue_depth=len(self.queue))
+        batches = max(stats['batches'], 1)
+        stats['mean_write_seconds'] = stats['write_seconds'] / batches
+        return stats
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
@@ -1,11 +1,10 @@
 """Renders game state on screen using PyGame.
 """
 
+import numpy as np
 import pygame as pg
 from plugins.base_renderer import BaseRenderer
 
-pg.font.init()
-pg.display.init()
 _TARGET_DISPLAY_SIZE = 600
 _HEADER_SIZE = 50 # Where score and other info is shown
 _BASE_CAPTION = "Snake AI"
@@ -16,12 +15,19 @@ _RED = (255, 0, 0)
 _WHITE = (255, 255, 255)
 _LIGHT_GRAY = (200, 200, 200)
 _GRAY = (50, 50, 50)
-_FONT = pg.font.Font(None, 26)
+_FONT_SIZE = 26
 _BIG_FONT_SIZE = 42
-_BIG_FONT = pg.font.Font(None, _BIG_FONT_SIZE)
+_MAX_CACHED_TEXTS = 64
+_MAX_CHANGED_CELLS = 64 # Above this, the whole arena is drawn again
 
 class PgRenderer(BaseRenderer):
     def __init__(self, env):
+        # Initialized here rather than on import, so that importing the
+        # plugin works without a display
+        pg.display.init()
+        pg.font.init()
+        self.font = pg.font.Font(None, _FONT_SIZE)
+        self.big_font = pg.font.Font(None, _BIG_FONT_SIZE)
         self.grid_size = env.grid_size
         self.scale_factor = _TARGET_DISPLAY_SIZE // self.grid_size
         self.arena_size = env.grid_size * self.scale_factor
@@ -32,7 +38,15 @@ class PgRenderer(BaseRenderer):
         self.screen = pg.display \
                         .set_mode(size=(self.arena_size, self.arena_size + _HEADER_SIZE), depth=8)
         self.arena.set_palette([_BLACK, _BLUE, _GREEN, _RED, _WHITE, _GRAY])
+        # One pixel per cell, scaled up to the arena
+        self.grid = pg.Surface(size=(self.grid_size, self.grid_size), depth=8)
+        self.grid.set_palette([_BLACK, _BLUE, _GREEN, _RED, _WHITE, _GRAY])
         self.blink_count = 0
+        self.texts = {}
+        # What is on screen, to skip frames where nothing changed
+        self.drawn_state = None
+        self.drawn_overlay = None
+        self.drawn_header = None
 
     def set_caption(self, text):
         """Appends text to base caption."""
@@ -40,32 +54,71 @@ class PgRenderer(BaseRenderer):
             return
         pg.display.set_caption(f"{_BASE_CAPTION} - {text}")
 
+    def text(self, text, font, color, pos, pos_mode='topleft'):
+        """Returns create_text results, rendering each text only once."""
+        key = (text, id(font), color, pos, pos_mode)
+        cached = self.texts.get(key)
+        if cached is None:
+            if len(self.texts) >= _MAX_CACHED_TEXTS:
+                self.texts.clear()
+            cached = self.texts[key] = create_text(text, font, color, pos, pos_mode)
+        return cached
+
     def render(self, state, _env, score, info):
-        """Read raw state and convert to pixel array. Each cell on the raw grid should
-        be inflated by scale_factor, so it becomes a scale_factor x scale_factor pixel array.
+        """Draws the raw state, one pixel per cell, on a grid-sized surface
+        scaled up by scale_factor into the arena. After a step, when only a
+        few cells changed, just those cells are filled instead. The header
+        is drawn when the score or playback label changed, and only the
+        parts of the display that were drawn are updated.
         """
-        pix_array = state.squeeze().T.reshape(self.grid_size, self.grid_size) \
-                         .repeat(self.scale_factor, axis=0).repeat(self.scale_factor, axis=1)
-        pg.surfarray.blit_array(self.arena, pix_array)
-        self.screen.blit(self.arena, self.arena_rect)
-
-        # Score
-        self.header.fill(_BLACK)
-        text_surf, text_rect = create_text(f"Score: {score}", _FONT, _WHITE, (10, 10))
-        self.header.blit(text_surf, text_rect)
-
+        show_playback = False
         if info['is_playback']:
-            if self.blink_count < 30:
-                pb_surf, pb_rect = create_text(
-                    f"-- Playback --", _FONT, _LIGHT_GRAY,
-                    (self.header_rect.centerx, self.header_rect.bottom - 10), 'midbottom')
-                self.header.blit(pb_surf, pb_rect)
+            show_playback = self.blink_count < 30
             self.blink_count += 1
             if self.blink_count >= 60:
                 self.blink_count = 0
+        header = (score, show_playback)
+        overlay = (info['dead'], info['is_playback'])
+        state = np.asarray(state)
 
-        # Blit header
-        self.screen.blit(self.header, self.header_rect)
+        rects = []
+        if self.drawn_state is None or overlay != self.drawn_overlay or info['dead']:
+            changed = None
+        else:
+            changed = np.flatnonzero(state.reshape(-1) != self.drawn_state.reshape(-1))
+        if changed is None or changed.size > _MAX_CHANGED_CELLS:
+            self.draw_arena(state, info)
+            rects.append(self.arena_rect)
+        elif changed.size:
+            rects.extend(self.draw_cells(state, changed))
+        self.drawn_state = state.copy()
+        self.drawn_overlay = overlay
+        if header != self.drawn_header:
+            self.draw_header(score, show_playback)
+            self.drawn_header = header
+            rects.append(self.header_rect)
+        if rects:
+            pg.display.update(rects)
+
+    def draw_cells(self, state, cells):
+        """Draws the given flat cell indices, returning their screen rects."""
+        values = state.reshape(-1)[cells]
+        rects = []
+        for cell, value in zip(cells.tolist(), values.tolist()):
+            row, col = divmod(cell, self.grid_size)
+            rect = pg.Rect(col * self.scale_factor, row * self.scale_factor,
+                           self.scale_factor, self.scale_factor)
+            self.arena.fill(value, rect)
+            rects.append(self.screen.blit(self.arena, rect.move(0, _HEADER_SIZE), rect))
+        if rects and rects[0].top == _HEADER_SIZE:
+            # The divider overlaps the top row of cells
+            pg.draw.line(self.screen, _GRAY, (0, _HEADER_SIZE), (self.arena_size, _HEADER_SIZE))
+        return rects
+
+    def draw_arena(self, state, info):
+        pg.surfarray.blit_array(self.grid, state.reshape(self.grid_size, self.grid_size).T)
+        pg.transform.scale(self.grid, self.arena.get_size(), self.arena)
+        self.screen.blit(self.arena, self.arena_rect)
 
         # Divider
         pg.draw.line(self.screen, _GRAY, (0, _HEADER_SIZE), (self.arena_size, _HEADER_SIZE))
@@ -73,21 +126,30 @@ class PgRenderer(BaseRenderer):
         # Game over
         if info['dead']:
             arena_center = self.arena_size // 2
-            go_surf, go_rect = create_text(
-                "Game Over", _BIG_FONT, _WHITE, (arena_center, arena_center + _HEADER_SIZE),
+            go_surf, go_rect = self.text(
+                "Game Over", self.big_font, _WHITE, (arena_center, arena_center + _HEADER_SIZE),
                 'center')
             self.screen.blit(go_surf, go_rect)
             if info['is_playback']:
                 text = "Press 'Space' to continue or 'R' to restart"
             else:
                 text = "Press 'R' to restart"
-            go_surf, go_rect = create_text(
-                text, _BIG_FONT, _WHITE,
+            go_surf, go_rect = self.text(
+                text, self.big_font, _WHITE,
                 (arena_center, arena_center + _HEADER_SIZE + _BIG_FONT_SIZE),
                 'center')
             self.screen.blit(go_surf, go_rect)
 
-        pg.display.flip()
+    def draw_header(self, score, show_playback):
+        self.header.fill(_BLACK)
+        text_surf, text_rect = self.text(f"Score: {score}", self.font, _WHITE, (10, 10))
+        self.header.blit(text_surf, text_rect)
+        if show_playback:
+            pb_surf, pb_rect = self.text(
+                "-- Playback --", self.font, _LIGHT_GRAY,
+                (self.header_rect.centerx, self.header_rect.bottom - 10), 'midbottom')
+            self.header.blit(pb_surf, pb_rect)
+        self.screen.blit(self.header, self.header_rect)
 
 def create_text(text, font, color, pos, pos_mode='topleft'):
     """Creates a text surface with rendered text and corresponding rect.
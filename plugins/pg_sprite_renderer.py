@@ -4,11 +4,8 @@
 import pygame as pg
 import numpy as np
 from plugins.base_renderer import BaseRenderer
-from plugins.snake_env import SnakeEnv
 from os import path
 
-pg.font.init()
-pg.display.init()
 _TARGET_DISPLAY_SIZE = 600
 _HEADER_SIZE = 50 # Where score and other info is shown
 _BASE_CAPTION = "Snake AI"
@@ -19,17 +16,23 @@ _RED = (255, 0, 0)
 _WHITE = (255, 255, 255)
 _LIGHT_GRAY = (200, 200, 200)
 _GRAY = (50, 50, 50)
-_FONT = pg.font.Font(None, 26)
+_FONT_SIZE = 26
 _BIG_FONT_SIZE = 42
-_BIG_FONT = pg.font.Font(None, _BIG_FONT_SIZE)
+_DIRECTIONS = ['u', 'r', 'd', 'l']
+# Direction of a neighbouring segment, by its offset (row, column) from a
+# segment, which picks the tiles drawn by blit_snake and update_cells
+_OFFSET_DIRECTIONS = {(1, 0): 'd', (-1, 0): 'u', (0, 1): 'r', (0, -1): 'l'}
 
-            
+def _direction(other, pos):
+    return _OFFSET_DIRECTIONS.get((other[0] - pos[0], other[1] - pos[1]), 'l')
 
-
-        
 class PgSpriteRenderer(BaseRenderer):
     def __init__(self, env):
         BaseRenderer.__init__(self, env)
+        pg.display.init()
+        pg.font.init()
+        self.font = pg.font.Font(None, _FONT_SIZE)
+        self.big_font = pg.font.Font(None, _BIG_FONT_SIZE)
         self.grid_size = env.grid_size
         self.scale_factor = _TARGET_DISPLAY_SIZE // self.grid_size
         self.arena_size = env.grid_size * self.scale_factor
@@ -47,10 +50,18 @@ class PgSpriteRenderer(BaseRenderer):
         self.im_snake_tail = images[2]
         self.im_snake_curve = images[3]
         self.im_apple = pg.transform.rotate(images[4], 270)
-        self.head = None
-        self.tail = None
-        self.dirty_rects = []
+        # Tiles for every orientation, built once: the head by current
+        # direction, the tail by direction of the segment before it and
+        # the body by directions of both neighbouring segments
+        self.head_tiles = {d: self.rotate(self.im_snake_head, d) for d in _DIRECTIONS + [None]}
+        self.tail_tiles = {d: self.rotate(self.im_snake_tail, d) for d in _DIRECTIONS}
+        self.body_tiles = {(d1, d2): self.get_body_image(d1, d2)
+                           for d1 in _DIRECTIONS for d2 in _DIRECTIONS}
         self.blink_count = 0
+        # What is on screen, to find what changed on the next frame
+        self.drawn_snake = None
+        self.drawn_frame = None
+        self.drawn_header = None
 
     def load_spritesheet(self, filename, tile_size=16, colorkey=None):
         fullpath = path.join('data', filename)
@@ -71,7 +82,7 @@ class PgSpriteRenderer(BaseRenderer):
                 img = pg.Surface(rect.size).convert()
                 img.blit(image_sheet, (0, 0), rect)
                 if colorkey is not None:
-                    if colorkey is -1:
+                    if colorkey == -1:
                         colorkey = img.get_at((0, 0))
                     img.set_colorkey(colorkey, pg.RLEACCEL)
                 img = pg.transform.scale(img, (self.scale_factor, self.scale_factor))
@@ -87,25 +98,18 @@ class PgSpriteRenderer(BaseRenderer):
     def blit_snake(self, snake, curr_dir):
         if not snake:
             return
+        snake = list(snake) # Env keeps a deque, which can't be sliced
+        last = len(snake) - 1
+        blits = []
         for i, pos in enumerate(snake):
-            next_dir = None
             if i == 0:
-                direction = curr_dir
-                image = pg.Surface.copy(self.im_snake_head)
-            elif i == len(snake) - 1:
-                direction, next_dir = self.get_direction(snake[i-1:])
-                image = pg.Surface.copy(self.im_snake_tail)
+                image = self.head_tiles[curr_dir]
+            elif i == last:
+                image = self.tail_tiles[_direction(snake[i-1], pos)]
             else:
-                direction, next_dir = self.get_direction(snake[i-1: i+2])
-                image = self.get_body_image(direction, next_dir)
-            snake_rect = pg.Rect(
-                (pos[1] * self.scale_factor, pos[0] * self.scale_factor + _HEADER_SIZE),
-                (self.scale_factor, self.scale_factor)
-            )
-            if next_dir is None:
-                image = self.rotate(image, direction)
-            self.screen.blit(image, snake_rect)
-            self.dirty_rects.append(snake_rect)
+                image = self.body_tiles[(_direction(snake[i-1], pos), _direction(snake[i+1], pos))]
+            blits.append((image, self.cell_rect(pos)))
+        self.screen.blits(blits, doreturn=False)
 
     def get_body_image(self, dir1, dir2):
         if 'l' in [dir1, dir2]:
@@ -121,48 +125,6 @@ class PgSpriteRenderer(BaseRenderer):
                 return pg.Surface.copy(self.im_snake_curve)
         return pg.transform.rotate(self.im_snake_curve, 90)
 
-    def get_direction(self, snake_section):
-        """Returns relative directions of a snake segment, so that the proper
-        tile can be chosen for drawing.
-        
-        Returns two directions, the value being one of 'u', 'd', 'r', 'l'.
-        Given a 3-element section of the snake, the first direction is
-        the one that takes the element from i=1 to i=0, i being the section index.
-        For example, if the element i=0 has y=1 and i=1 has y=2, the direction
-        should be 'u', since upwards is the direction of decreasing y.
-        
-        The second direction is the one that takes element i=1 to i=2.
-        For example, if the element i=1 has x=3 and i=2 has x=4, the direction is
-        'r', the direction if increasing x.
-
-        If given a 2-element section, the element i=1 represents the end of the snake
-        and therefore only the first direction is returned, the other output being None.
-        """
-        sec_other = snake_section[0]
-        sec_curr = snake_section[1]
-        if sec_curr[0] - sec_other[0] < 0:
-            direction = 'd'
-        elif sec_curr[0] - sec_other[0] > 0:
-            direction = 'u'
-        elif sec_curr[1] - sec_other[1] < 0:
-            direction = 'r'
-        else:
-            direction = 'l'
-
-        if len(snake_section) < 3:
-            return direction, None
-
-        sec_other = snake_section[2]
-        if sec_curr[0] - sec_other[0] < 0:
-            next_direction = 'd'
-        elif sec_curr[0] - sec_other[0] > 0:
-            next_direction = 'u'
-        elif sec_curr[1] - sec_other[1] < 0:
-            next_direction = 'r'
-        else:
-            next_direction = 'l'
-        return direction, next_direction
-
     def rotate(self, surf, direction):
         if direction == 'r':
             return pg.transform.rotate(surf, 180)
@@ -174,42 +136,92 @@ class PgSpriteRenderer(BaseRenderer):
             return surf
 
 
+    def cell_rect(self, pos):
+        return pg.Rect(
+            (pos[1] * self.scale_factor, pos[0] * self.scale_factor + _HEADER_SIZE),
+            (self.scale_factor, self.scale_factor)
+        )
+
     def render(self, state, env, score, info):
-        """Read raw state and convert to pixel array. Each cell on the raw grid should
-        be inflated by scale_factor, so it becomes a scale_factor x scale_factor pixel array.
+        """Draws what changed since the last frame and updates only those
+        parts of the display. When the snake made a single move, only its
+        head, neck and tail cells and the apple are drawn again. Anything
+        else, such as a reset or the game over screen, redraws the arena.
+        Nothing is drawn when neither the game nor the header changed.
         """
-        for rect in self.dirty_rects:
-            self.screen.blit(self.background, rect)
-        self.dirty_rects = []
-        self.blit_snake(env.snake, env.curr_dir)
-
-        # Apple
-        if env.apple:
-            apple_rect = pg.Rect(
-                (env.apple[1] * self.scale_factor, env.apple[0] * self.scale_factor + _HEADER_SIZE),
-                (self.scale_factor, self.scale_factor)
-            )
-            self.screen.blit(self.im_apple, apple_rect)
-            self.dirty_rects.append(apple_rect)
-        
-        
-        # Score
-        self.header.fill(_BLACK)
-        text_surf, text_rect = create_text(f"Score: {score}", _FONT, _WHITE, (10, 10))
-        self.header.blit(text_surf, text_rect)
-
+        snake = env.snake
+        frame = (snake[0], snake[-1], len(snake), env.apple, env.curr_dir, info['dead'],
+                 info['is_playback'], env.step_index) if snake else None
+        show_playback = False
         if info['is_playback']:
-            if self.blink_count < 30:
-                pb_surf, pb_rect = create_text(
-                    f"-- Playback --", _FONT, _LIGHT_GRAY,
-                    (self.header_rect.centerx, self.header_rect.bottom - 10), 'midbottom')
-                self.header.blit(pb_surf, pb_rect)
+            show_playback = self.blink_count < 30
             self.blink_count += 1
             if self.blink_count >= 60:
                 self.blink_count = 0
+        header = (score, show_playback)
 
-        # Blit header
-        self.screen.blit(self.header, self.header_rect)
+        rects = []
+        full = False
+        if frame != self.drawn_frame or snake is not self.drawn_snake:
+            if not self.update_cells(snake, env, frame, rects):
+                self.draw_arena(snake, env, info)
+                full = True
+            self.drawn_snake = snake
+            self.drawn_frame = frame
+        if full or header != self.drawn_header:
+            self.draw_header(score, show_playback)
+            self.drawn_header = header
+            rects.append(self.header_rect)
+
+        if full:
+            pg.display.flip()
+        elif rects:
+            pg.display.update(rects)
+
+    def update_cells(self, snake, env, frame, rects):
+        """Draws the cells changed by a single move of the snake, adding their
+        rects to rects. Returns False, drawing nothing, unless the env made
+        exactly one step since the last frame, as frames may skip steps."""
+        last = self.drawn_frame
+        if frame is None or last is None or snake is not self.drawn_snake \
+                or frame[7] != last[7] + 1 or frame[5] or last[5] or len(snake) < 3 \
+                or snake[1] != last[0]:
+            return False
+        if len(snake) == last[2]:
+            dropped_tail = last[1]
+        elif len(snake) == last[2] + 1 and snake[-1] == last[1]:
+            dropped_tail = None
+        else:
+            return False
+        erased = [pos for pos in (dropped_tail, last[3]) if pos is not None and pos != env.apple]
+        for pos in erased:
+            rect = self.cell_rect(pos)
+            self.screen.blit(self.background, rect, rect.move(0, -_HEADER_SIZE))
+            rects.append(rect)
+        tail = snake[-1]
+        neck = snake[1]
+        # Same order as blit_snake, in case the head is on the tail cell
+        blits = [
+            (self.head_tiles[env.curr_dir], self.cell_rect(snake[0])),
+            (self.body_tiles[(_direction(snake[0], neck), _direction(snake[2], neck))],
+             self.cell_rect(neck)),
+            (self.tail_tiles[_direction(snake[-2], tail)], self.cell_rect(tail))
+        ]
+        if env.apple:
+            blits.append((self.im_apple, self.cell_rect(env.apple)))
+        self.screen.blits(blits, doreturn=False)
+        rects.extend(rect for _image, rect in blits)
+        # The divider overlaps the top row of cells
+        pg.draw.line(self.screen, _GRAY, (0, _HEADER_SIZE), (self.arena_size, _HEADER_SIZE))
+        return True
+
+    def draw_arena(self, snake, env, info):
+        self.screen.blit(self.background, (0, _HEADER_SIZE))
+        self.blit_snake(snake, env.curr_dir)
+
+        # Apple
+        if env.apple:
+            self.screen.blit(self.im_apple, self.cell_rect(env.apple))
 
         # Divider
         pg.draw.line(self.screen, _GRAY, (0, _HEADER_SIZE), (self.arena_size, _HEADER_SIZE))
@@ -218,22 +230,29 @@ class PgSpriteRenderer(BaseRenderer):
         if info['dead']:
             arena_center = self.arena_size // 2
             go_surf, go_rect = create_text(
-                "Game Over", _BIG_FONT, _WHITE, (arena_center, arena_center + _HEADER_SIZE),
+                "Game Over", self.big_font, _WHITE, (arena_center, arena_center + _HEADER_SIZE),
                 'center')
             self.screen.blit(go_surf, go_rect)
-            self.dirty_rects.append(go_rect)
             if info['is_playback']:
                 text = "Press 'Space' to continue or 'R' to restart"
             else:
                 text = "Press 'R' to restart"
             key_surf, key_rect = create_text(
-                text, _BIG_FONT, _WHITE,
+                text, self.big_font, _WHITE,
                 (arena_center, arena_center + _HEADER_SIZE + _BIG_FONT_SIZE),
                 'center')
-            self.dirty_rects.append(key_rect)
             self.screen.blit(key_surf, key_rect)
 
-        pg.display.flip()
+    def draw_header(self, score, show_playback):
+        self.header.fill(_BLACK)
+        text_surf, text_rect = create_text(f"Score: {score}", self.font, _WHITE, (10, 10))
+        self.header.blit(text_surf, text_rect)
+        if show_playback:
+            pb_surf, pb_rect = create_text(
+                f"-- Playback --", self.font, _LIGHT_GRAY,
+                (self.header_rect.centerx, self.header_rect.bottom - 10), 'midbottom')
+            self.header.blit(pb_surf, pb_rect)
+        self.screen.blit(self.header, self.header_rect)
 
 def create_text(text, font, color, pos, pos_mode='topleft'):
     """Creates a text surface with rendered text and corresponding rect.
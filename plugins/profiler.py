@@ -0,0 +1,151 @@
+"""Times phases of the game loop into fixed-bucket histograms.
+
+Profiling is off unless enable() was called, in which case timer(name)
+returns a Timer registered in the active Profiler. Otherwise it returns
+a timer that does nothing, so plugins can ask for their own timers when
+they are created and use them unconditionally:
+
+    self.write_timer = profiler.timer('my_plugin.write')
+    ...
+    with self.write_timer:
+        write()
+"""
+
+import bisect
+import json
+import time
+
+# Upper bounds of the histogram buckets in seconds, four per doubling from
+# 1 microsecond to about 17 seconds. Percentiles are within about 19%.
+BUCKET_BOUNDS = [1e-6 * 2 ** (i / 4) for i in range(97)]
+PERCENTILES = [50, 95, 99]
+
+class Timer:
+    """Histogram of the durations of one phase. Used as a context manager,
+    it times the block it wraps; a timer is not reentrant and is expected
+    to be recorded by one thread at a time."""
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc):
+        self.record(time.perf_counter() - self.start)
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile, or the
+        longest duration if lower."""
+        if not self.count:
+            return 0.0
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                bound = BUCKET_BOUNDS[i] if i < len(BUCKET_BOUNDS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        """Durations in milliseconds, with the non-empty buckets by upper
+        bound in microseconds."""
+        summary = {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.max * 1000
+        }
+        for q in PERCENTILES:
+            summary[f'p{q}_ms'] = self.percentile(q) * 1000
+        summary['buckets_us'] = {
+            'inf' if i == len(BUCKET_BOUNDS) else f'{BUCKET_BOUNDS[i] * 1e6:.3f}': count
+            for i, count in enumerate(self.counts) if count
+        }
+        return summary
+
+class NullTimer:
+    """Timer of a disabled profiler."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        pass
+
+    def record(self, _seconds):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class Profiler:
+    """Timers by name, with a report of all of them."""
+    def __init__(self):
+        self.timers = {}
+        self.start = time.perf_counter()
+
+    def timer(self, name):
+        """Returns the timer of a phase, created on first use."""
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = Timer(name)
+        return timer
+
+    def report(self):
+        return {
+            'elapsed_s': time.perf_counter() - self.start,
+            'phases': {name: timer.summary() for name, timer in self.timers.items()}
+        }
+
+    def print_report(self):
+        report = self.report()
+        print(f"Profile of {report['elapsed_s']:.2f}s, times in ms")
+        print(f"{'phase':<24}{'count':>9}{'total':>10}{'mean':>9}"
+              + ''.join(f'{f"p{q}":>9}' for q in PERCENTILES) + f"{'max':>9}")
+        for name, phase in report['phases'].items():
+            if not phase['count']:
+                continue
+            print(f"{name:<24}{phase['count']:>9}{phase['total_ms']:>10.1f}{phase['mean_ms']:>9.3f}"
+                  + ''.join(f"{phase[f'p{q}_ms']:>9.3f}" for q in PERCENTILES)
+                  + f"{phase['max_ms']:>9.3f}")
+        return report
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+_active = None
+
+def enable(profiler=None):
+    """Makes profiler, or a new one, the active profiler and returns it.
+    Timers taken before this call stay disabled."""
+    global _active # pylint: disable=global-statement
+    _active = profiler or Profiler()
+    return _active
+
+def disable():
+    global _active # pylint: disable=global-statement
+    _active = None
+
+def active():
+    """The active profiler, or None."""
+    return _active
+
+def timer(name):
+    """Timer of a phase in the active profiler, or one that does nothing
+    when profiling is off."""
+    if _active is None:
+        return NULL_TIMER
+    return _active.timer(name)
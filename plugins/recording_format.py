@@ -0,0 +1,239 @@
+"""Compact binary format for gameplay recordings.
+
+A recording starts with a header:
+    magic b'SNKR', version (u8), grid size (u16), keyframe interval (u16),
+    seed (i64, -1 if unknown)
+followed by one record per step:
+    flags (u8): direction code in bits 0-2, done in bit 3, keyframe in bit 4
+    action (u8), reward (i8)
+    keyframe: the whole grid, 2 bits per cell, 4 cells per byte, row-major
+    delta: number of changed cells (u8), then one u16 per change holding
+           the new cell value in the top 2 bits and the flat cell index in
+           the other 14
+All values are little-endian. The first record is always a keyframe, so
+it holds the initial snake. On a normal step only the new head, the neck,
+the dropped tail and the apple cells change, so a step takes a few bytes.
+
+Action logs store only what is needed to run a SnakeEnv game again:
+    magic b'SNKA', version (u8), grid size (u16), options (u8, bit 0 set
+    for legacy_spawn), seed (i64)
+followed by one byte per event: the action of a step, or RESET_EVENT when
+the env was reset.
+"""
+
+import pickle
+import struct
+import numpy as np
+
+MAGIC = b'SNKR'
+VERSION = 1
+KEYFRAME_INTERVAL = 500
+_HEADER = struct.Struct('<4sBHHq')
+ACTION_LOG_MAGIC = b'SNKA'
+ACTION_LOG_VERSION = 1
+RESET_EVENT = 0xff
+_ACTION_LOG_HEADER = struct.Struct('<4sBHBq')
+_LEGACY_SPAWN_OPTION = 0x01
+_STEP = struct.Struct('<BBb')
+_CHANGE = np.dtype('<u2')
+_DIRECTIONS = ['u', 'r', 'd', 'l', None]
+DONE_FLAG = 0x08
+KEYFRAME_FLAG = 0x10
+_MAX_GRID_SIZE = 128 # Flat cell indices must fit in 14 bits
+_MAX_CHANGES = 255
+# Entry of a recording index, which only lists the steps that are
+# keyframes, have a reward or end a game: step, offset of its record in the
+# file, record flags (as in the format above) and reward
+INDEX_DTYPE = np.dtype([('step', '<u4'), ('offset', '<u8'), ('flags', 'u1'), ('reward', 'i1')])
+
+def recording_kind(filename):
+    """Returns 'frames' for binary recordings, 'actions' for action logs
+    and 'pickle' for anything else."""
+    with open(filename, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        return 'frames'
+    if magic == ACTION_LOG_MAGIC:
+        return 'actions'
+    return 'pickle'
+
+def is_binary_recording(filename):
+    return recording_kind(filename) == 'frames'
+
+def action_log_header(grid_size, seed, legacy_spawn=False):
+    options = _LEGACY_SPAWN_OPTION if legacy_spawn else 0
+    return _ACTION_LOG_HEADER.pack(ACTION_LOG_MAGIC, ACTION_LOG_VERSION, grid_size, options, seed)
+
+def read_action_log(data):
+    """Returns the SnakeEnv parameters of an action log, as keyword
+    arguments, and its events as an array of bytes."""
+    magic, version, grid_size, options, seed = _ACTION_LOG_HEADER.unpack_from(data, 0)
+    if magic != ACTION_LOG_MAGIC:
+        raise ValueError('Not an action log')
+    if version > ACTION_LOG_VERSION:
+        raise ValueError(f'Unsupported action log version {version}')
+    params = {
+        'grid_size': grid_size,
+        'seed': seed,
+        'legacy_spawn': bool(options & _LEGACY_SPAWN_OPTION)
+    }
+    events = np.frombuffer(data, dtype=np.uint8, offset=_ACTION_LOG_HEADER.size)
+    return params, events
+
+def pack_grid(grid):
+    cells = np.asarray(grid, dtype=np.uint8).reshape(-1)
+    padded = np.zeros(-(-cells.size // 4) * 4, dtype=np.uint8)
+    padded[:cells.size] = cells
+    quads = padded.reshape(-1, 4)
+    return (quads[:, 0] | quads[:, 1] << 2 | quads[:, 2] << 4 | quads[:, 3] << 6).tobytes()
+
+def unpack_grid(data, grid_size):
+    packed = np.frombuffer(data, dtype=np.uint8)
+    cells = (packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+    return cells.reshape(-1)[:grid_size * grid_size].reshape(grid_size, grid_size, 1)
+
+class RecordingEncoder:
+    """Turns the steps passed to an aux plugin into bytes of a recording.
+    """
+    def __init__(self, grid_size, seed=None, keyframe_interval=KEYFRAME_INTERVAL):
+        if grid_size > _MAX_GRID_SIZE:
+            raise ValueError(f'Grid size {grid_size} is above {_MAX_GRID_SIZE}')
+        self.grid_size = grid_size
+        self.seed = seed
+        self.keyframe_interval = keyframe_interval
+        self.prev = None
+        self.count = 0
+
+    def header(self):
+        seed = -1 if self.seed is None else self.seed
+        return _HEADER.pack(MAGIC, VERSION, self.grid_size, self.keyframe_interval, seed)
+
+    def encode(self, state, reward, done, curr_dir, action):
+        grid = np.asarray(state, dtype=np.uint8).reshape(-1)
+        flags = _DIRECTIONS.index(curr_dir)
+        if done:
+            flags |= DONE_FLAG
+        action = action if isinstance(action, (int, np.integer)) else 0
+        changed = None
+        if self.prev is not None and self.count % self.keyframe_interval != 0:
+            changed = np.flatnonzero(grid != self.prev)
+            if changed.size > _MAX_CHANGES:
+                changed = None
+        self.prev = grid.copy()
+        self.count += 1
+        if changed is None:
+            flags |= KEYFRAME_FLAG
+            return _STEP.pack(flags, action, int(reward)) + pack_grid(grid)
+        changes = (grid[changed].astype(_CHANGE) << 14) | changed.astype(_CHANGE)
+        return _STEP.pack(flags, action, int(reward)) + bytes([changed.size]) \
+                + changes.tobytes()
+
+class RecordingReader:
+    """Decodes a binary recording held in a bytes-like object.
+    """
+    FIRST_RECORD = _HEADER.size
+
+    def __init__(self, data):
+        self.data = data
+        magic, self.version, self.grid_size, self.keyframe_interval, seed = \
+            _HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a binary recording')
+        if self.version > VERSION:
+            raise ValueError(f'Unsupported recording version {self.version}')
+        self.seed = None if seed < 0 else seed
+        self.keyframe_size = -(-self.grid_size * self.grid_size // 4)
+
+    def record_at(self, offset):
+        """Parses the record starting at offset. Returns the offset of the
+        next record, whether this one is a keyframe, the step values and
+        the payload: packed grid bytes for keyframes, otherwise the changes.
+        """
+        flags, action, reward = _STEP.unpack_from(self.data, offset)
+        offset += _STEP.size
+        curr_dir = _DIRECTIONS[flags & 0x07]
+        done = bool(flags & DONE_FLAG)
+        if flags & KEYFRAME_FLAG:
+            end = offset + self.keyframe_size
+            payload = self.data[offset:end]
+            keyframe = True
+        else:
+            count = self.data[offset]
+            offset += 1
+            end = offset + count * _CHANGE.itemsize
+            payload = np.frombuffer(self.data, dtype=_CHANGE, count=count, offset=offset)
+            keyframe = False
+        return end, keyframe, (reward, done, curr_dir, action), payload
+
+    def record_complete(self, offset):
+        """Whether a whole record starts at offset, which is not the case at
+        the end of the data or of a recording cut short while being written."""
+        if offset + _STEP.size + 1 > len(self.data):
+            return False
+        if self.data[offset] & KEYFRAME_FLAG:
+            end = offset + _STEP.size + self.keyframe_size
+        else:
+            end = offset + _STEP.size + 1 + self.data[offset + _STEP.size] * _CHANGE.itemsize
+        return end <= len(self.data)
+
+    def build_index(self):
+        """Scans the record headers, returning the number of steps and an
+        array of INDEX_DTYPE with the steps that are keyframes, have a
+        reward or end a game. No grid is decoded."""
+        entries = []
+        step = 0
+        offset = self.FIRST_RECORD
+        while self.record_complete(offset):
+            record_flags, _action, reward = _STEP.unpack_from(self.data, offset)
+            if record_flags & (KEYFRAME_FLAG | DONE_FLAG) or reward:
+                entries.append((step, offset, record_flags, reward))
+            step += 1
+            offset += _STEP.size
+            if record_flags & KEYFRAME_FLAG:
+                offset += self.keyframe_size
+            else:
+                offset += 1 + self.data[offset] * _CHANGE.itemsize
+        return step, np.array(entries, dtype=INDEX_DTYPE)
+
+    def apply(self, grid, keyframe, payload):
+        """Returns the grid after a record, given the grid before it."""
+        if keyframe:
+            return unpack_grid(payload, self.grid_size).copy()
+        grid = grid.copy()
+        grid.reshape(-1)[payload & 0x3fff] = payload >> 14
+        return grid
+
+    def __iter__(self):
+        """Yields [state, reward, done, curr_dir, action] for every step, as
+        they were passed to the recorder."""
+        offset = self.FIRST_RECORD
+        grid = None
+        while self.record_complete(offset):
+            offset, keyframe, values, payload = self.record_at(offset)
+            grid = self.apply(grid, keyframe, payload)
+            reward, done, curr_dir, action = values
+            yield [grid, reward, done, curr_dir, action]
+
+def load_pickle_recording(filename):
+    mem = []
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                mem.append(pickle.load(f))
+            except EOFError:
+                break
+    return mem
+
+def convert_pickle_recording(src, dst, seed=None, keyframe_interval=KEYFRAME_INTERVAL):
+    """Writes a pickle recording from earlier versions in the binary format.
+    Returns the number of steps converted."""
+    memory = load_pickle_recording(src)
+    if not memory:
+        raise ValueError(f'Nothing recorded in {src}')
+    grid_size = np.array(memory[0][0]).shape[0]
+    encoder = RecordingEncoder(grid_size, seed, keyframe_interval)
+    with open(dst, 'wb') as f:
+        f.write(encoder.header())
+        for item in memory:
+            f.write(encoder.encode(*item))
+    return len(memory)
@@ -1,3 +1,4 @@
+from collections import deque
 import gym
 import numpy as np
 from gym import spaces
@@ -6,23 +7,119 @@ APPLE_REWARD = 1
 DEATH_PENALTY = -1
 SNAKE_GROWTH = 2
 
+# New direction after turning left (action 1) or right (action 2)
+_TURN_LEFT = {'u': 'l', 'l': 'd', 'd': 'r', 'r': 'u'}
+_TURN_RIGHT = {'u': 'r', 'l': 'u', 'd': 'l', 'r': 'd'}
+# (dy, dx) of a head movement in each direction
+_MOVES = {'r': (0, 1), 'l': (0, -1), 'u': (-1, 0), 'd': (1, 0)}
+
+class CellIndex:
+    """Set of flat cell indices with O(1) insert, remove and uniform sampling.
+
+    Cells are kept in a permutation of the whole arena, the first `size`
+    entries being the members of the set, plus the position of each cell in
+    that permutation. Inserting or removing swaps a cell across the boundary.
+    """
+    def __init__(self, arena_length):
+        self.cells = list(range(arena_length))
+        self.positions = list(range(arena_length))
+        self.size = arena_length
+
+    def __len__(self):
+        return self.size
+
+    def fill(self):
+        self.cells = list(range(len(self.cells)))
+        self.positions = list(range(len(self.cells)))
+        self.size = len(self.cells)
+
+    def _swap(self, cell, pos):
+        other = self.cells[pos]
+        old_pos = self.positions[cell]
+        self.cells[pos], self.cells[old_pos] = cell, other
+        self.positions[cell], self.positions[other] = pos, old_pos
+
+    def insert(self, cell):
+        if self.positions[cell] >= self.size:
+            self._swap(cell, self.size)
+            self.size += 1
+
+    def remove(self, cell):
+        if self.positions[cell] < self.size:
+            self.size -= 1
+            self._swap(cell, self.size)
+
+    def snapshot(self):
+        return np.array(self.cells, dtype=np.int32), self.size
+
+    def restore(self, snapshot):
+        cells, self.size = snapshot
+        self.cells = cells.tolist()
+        self.positions = [0] * len(self.cells)
+        for pos, cell in enumerate(self.cells):
+            self.positions[cell] = pos
+
+    def sample(self, rng):
+        """Returns a random member using the given RandomState, or None if
+        the set is empty."""
+        if self.size == 0:
+            return None
+        return self.cells[rng.randint(self.size)]
+
 class SnakeEnv(gym.Env):
     APPLE_GRID_VAL = 3
     HEAD_GRID_VAL = 2
     COLL_GRID_VAL = 1
 
-    def __init__(self, grid_size=40, seed=None):
-        if seed:
-            np.random.seed(seed)
+    def __init__(self, grid_size=40, seed=None, reuse_obs=False, legacy_spawn=False):
+        """The snake body is kept in a deque, together with a persistent
+        occupancy grid which is only updated at the cells that change on a
+        step (head, neck, tail and apple), so a step costs the same for any
+        snake length. Apples are drawn from an index of the empty cells.
+
+        If reuse_obs is set, observations are read-only views of the
+        internal grid instead of copies. They are cheaper, but change in
+        place on the next step, so they must not be stored.
+
+        Each env has its own RandomState. Without a seed, a random one is
+        drawn and kept in rng_seed, so that a game can be replayed from its
+        seed and actions.
+
+        If legacy_spawn is set, apples are placed by rejection sampling as
+        in earlier versions, which reproduces their seeded apple sequences.
+        """
+        self.rng = None
+        self.rng_seed = None
+        self.seed(seed)
         self.curr_dir = None
         self.grid_size = grid_size
+        self.reuse_obs = reuse_obs
+        self.legacy_spawn = legacy_spawn
         self.extend = 0
         self.snake_length = 0
+        self.step_index = 0 # Steps since the last reset
+        self.arena_length = self.grid_size * self.grid_size
+        # Number of segments from snake[1:-1] on each cell, which is what
+        # the head can collide with
+        self._body = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
+        # Number of segments of the whole snake on each cell, and the cells
+        # with none, where apples can spawn
+        self._occupancy = np.zeros((self.grid_size, self.grid_size), dtype=np.int32)
+        self._free = CellIndex(self.arena_length)
+        self._grid = np.zeros((self.grid_size, self.grid_size), dtype=np.uint8)
+        self._obs_view = self._grid.view().reshape((self.grid_size, self.grid_size, 1))
+        self._obs_view.flags.writeable = False
         self._reset_state()
         self.action_space = spaces.Discrete(3) # 0 do nothing, 1 turn left, 2 turn right
         self.observation_space = spaces.Box(0, 3, (self.grid_size, self.grid_size, 1))
         self.reward_range = (-5, APPLE_REWARD + 1)
-        self.arena_length = self.grid_size * self.grid_size
+
+    def seed(self, seed=None):
+        if seed is None:
+            seed = np.random.randint(2**31 - 1)
+        self.rng_seed = seed
+        self.rng = np.random.RandomState(seed)
+        return [seed]
 
     def is_playback(self):
         return False
@@ -30,8 +127,50 @@ class SnakeEnv(gym.Env):
     def _reset_state(self):
         self.curr_dir = 'l'
         self.extend = 0
-        self.snake = self.build_snake()
+        self.step_index = 0
+        self.apple = None
+        self.snake = deque(self.build_snake())
+        self._rebuild_grids()
         self.apple = self.spawn_apple()
+        self._paint(self.apple)
+
+    def _rebuild_grids(self):
+        """Fills the grids and the free cell index from the snake and apple."""
+        self._body.fill(0)
+        self._grid.fill(0)
+        self._occupancy.fill(0)
+        self._free.fill()
+        for pos in self.snake:
+            self._occupy(pos)
+        for i in range(1, len(self.snake) - 1):
+            self._add_body(self.snake[i])
+        self._paint(self.snake[0])
+        self._paint(self.apple)
+
+    def snapshot(self):
+        """Returns the game state, including the RNG, to be passed to restore."""
+        return {
+            'snake': list(self.snake),
+            'curr_dir': self.curr_dir,
+            'extend': self.extend,
+            'snake_length': self.snake_length,
+            'step_index': self.step_index,
+            'apple': self.apple,
+            'rng': self.rng.get_state(),
+            'free': self._free.snapshot()
+        }
+
+    def restore(self, snapshot):
+        self.snake = deque(snapshot['snake'])
+        self.curr_dir = snapshot['curr_dir']
+        self.extend = snapshot['extend']
+        self.snake_length = snapshot['snake_length']
+        self.step_index = snapshot['step_index']
+        self.apple = snapshot['apple']
+        self.rng.set_state(snapshot['rng'])
+        self._rebuild_grids()
+        # The order of free cells decides where the next apples spawn
+        self._free.restore(snapshot['free'])
 
     def build_snake(self):
         """Returns a list of contiguous coordinates forming the snake, and
@@ -47,6 +186,16 @@ class SnakeEnv(gym.Env):
         return self.normalize_state()
 
     def spawn_apple(self, observation=None):
+        """Spawn apple in a random empty cell, or return None if there is
+        none left."""
+        if self.legacy_spawn:
+            return self._spawn_apple_legacy(observation)
+        cell = self._free.sample(self.rng)
+        if cell is None:
+            return None
+        return divmod(cell, self.grid_size)
+
+    def _spawn_apple_legacy(self, observation=None):
         """Spawn apple in a random position, retrying if it happens
         to fall on the snake. When snake gets long enough, adopt a different
         strategy, finding empty spaces first and randomly selecting among
@@ -59,87 +208,113 @@ class SnakeEnv(gym.Env):
             empty_pos = empty_pos[empty_pos != 0]
             if empty_pos.size == 0:
                 return None
-            pos_idx = np.random.choice(empty_pos)
+            pos_idx = self.rng.choice(empty_pos)
             return (pos_idx // self.grid_size, pos_idx % self.grid_size)
 
-        apple_pos = tuple(np.random.randint(self.grid_size, size=2))
-        if self.collides(apple_pos, self.snake):
-            return self.spawn_apple()
-        else:
-            return apple_pos
+        apple_pos = tuple(self.rng.randint(self.grid_size, size=2))
+        while self.on_snake(apple_pos):
+            apple_pos = tuple(self.rng.randint(self.grid_size, size=2))
+        return apple_pos
 
     def collides(self, pos, list_pos):
         return pos in list_pos
 
+    def on_snake(self, pos):
+        """Whether an in-bounds position is covered by any part of the snake.
+        """
+        return self._occupancy[pos] > 0
+
     def step(self, action):
         done = False
         reward = 0
         if action == 1:
-            if self.curr_dir == 'u': self.curr_dir = 'l'
-            elif self.curr_dir == 'l': self.curr_dir = 'd'
-            elif self.curr_dir == 'd': self.curr_dir = 'r'
-            elif self.curr_dir == 'r': self.curr_dir = 'u'
+            self.curr_dir = _TURN_LEFT[self.curr_dir]
         elif action == 2:
-            if self.curr_dir == 'u': self.curr_dir = 'r'
-            elif self.curr_dir == 'l': self.curr_dir = 'u'
-            elif self.curr_dir == 'd': self.curr_dir = 'l'
-            elif self.curr_dir == 'r': self.curr_dir = 'd'
+            self.curr_dir = _TURN_RIGHT[self.curr_dir]
 
+        self.step_index += 1
         self.move()
         snake_head = self.snake[0]
 
-        if (snake_head[0] < 0) or (snake_head[0] >= self.grid_size) or (snake_head[1] < 0) or (snake_head[1] >= self.grid_size):
+        if not self._in_bounds(snake_head):
             done = True
-        elif self.collides(snake_head, self.snake[1:-1]):
+        elif self._body[snake_head]:
             done = True
 
-        observation = self.normalize_state()
         if done:
             reward -= abs(DEATH_PENALTY)
-        elif self.collides(self.apple, self.snake[0:1]):
+        elif self.apple == snake_head:
             reward += APPLE_REWARD
             self.extend += SNAKE_GROWTH
-            self.apple = self.spawn_apple(observation)
-            if self.apple:
-                observation[self.apple[0], self.apple[1], 0] = self.APPLE_GRID_VAL
+            self.apple = self.spawn_apple(self._grid)
+            self._paint(self.apple)
 
+        observation = self.normalize_state()
         if self.snake_length > self.arena_length:
             return observation, reward, True, {}
 
         return observation, reward, done, {}
 
     def move(self):
-        snake_head = self.snake[0]
+        snake = self.snake
+        snake_head = snake[0]
+        d_y, d_x = _MOVES[self.curr_dir]
+        new_head = (snake_head[0] + d_y, snake_head[1] + d_x)
+        snake.appendleft(new_head)
+        self._occupy(new_head)
+        # The old head becomes the neck, and the segment before the old
+        # tail becomes the new tail, which the head can't collide with
+        self._add_body(snake_head)
         if self.extend >= 0:
-            new_tail = self.snake
             self.extend -= 1
             self.snake_length += 1
         else:
-            new_tail = self.snake[0:-1]
-        if self.curr_dir == 'r':
-            self.snake = [(snake_head[0], snake_head[1] + 1)] + new_tail
-        elif self.curr_dir == 'l':
-            self.snake = [(snake_head[0], snake_head[1] - 1)] + new_tail
-        elif self.curr_dir == 'u':
-            self.snake = [(snake_head[0] - 1, snake_head[1])] + new_tail
-        elif self.curr_dir == 'd':
-            self.snake = [(snake_head[0] + 1, snake_head[1])] + new_tail
+            self._release(snake.pop())
+            self._remove_body(snake[-1])
+        self._paint(new_head)
+
+    def _in_bounds(self, pos):
+        return 0 <= pos[0] < self.grid_size and 0 <= pos[1] < self.grid_size
+
+    def _occupy(self, pos):
+        if self._in_bounds(pos):
+            self._occupancy[pos] += 1
+            self._free.remove(pos[0] * self.grid_size + pos[1])
 
+    def _release(self, pos):
+        if self._in_bounds(pos):
+            self._occupancy[pos] -= 1
+            if self._occupancy[pos] == 0:
+                self._free.insert(pos[0] * self.grid_size + pos[1])
+
+    def _add_body(self, pos):
+        if self._in_bounds(pos):
+            self._body[pos] += 1
+            self._grid[pos] = self.COLL_GRID_VAL
+
+    def _remove_body(self, pos):
+        if self._in_bounds(pos):
+            self._body[pos] -= 1
+            self._paint(pos)
+
+    def _paint(self, pos):
+        """Updates the grid value of a single cell. Body segments are drawn
+        over the head, which is drawn over the apple."""
+        if pos is None or not self._in_bounds(pos):
+            return
+        if self._body[pos]:
+            self._grid[pos] = self.COLL_GRID_VAL
+        elif pos == self.snake[0]:
+            self._grid[pos] = self.HEAD_GRID_VAL
+        elif pos == self.apple:
+            self._grid[pos] = self.APPLE_GRID_VAL
+        else:
+            self._grid[pos] = 0
 
     def normalize_state(self):
-        out = np.zeros((self.grid_size, self.grid_size), dtype=np.uint8)
-        if self.apple:
-            out[self.apple[0], self.apple[1]] = self.APPLE_GRID_VAL
-
-        head_y, head_x = self.snake[0]
-        if head_x >= 0 and head_x < self.grid_size and head_y >= 0 and head_y < self.grid_size:
-            out[head_y, head_x] = self.HEAD_GRID_VAL
-
-        for (y, x) in self.snake[1:-1]:
-            if x < 0 or x >= self.grid_size or y < 0 or y >= self.grid_size:
-                continue
-            out[y, x] = self.COLL_GRID_VAL
-        return np.reshape(out, (self.grid_size, self.grid_size, 1))
+        if self.reuse_obs:
+            return self._obs_view
+        return self._grid.reshape((self.grid_size, self.grid_size, 1)).copy()
 
     def render(self, mode='human'):
         norm_state = np.array(np.squeeze(self.normalize_state()))
@@ -5,9 +5,6 @@ import pygame as pg
 from os import path
 from plugins.base_sound import BaseSound
 
-pg.mixer.pre_init(buffer=128)
-pg.mixer.init()
-
 def load_sound(name):
     class NoneSound:
         def play(self):
@@ -27,6 +24,8 @@ class Sound(BaseSound):
     """Manages game sounds.
     """
     def __init__(self, *_args):
+        pg.mixer.pre_init(buffer=128)
+        pg.mixer.init()
         self.eat_snd = load_sound('eat.wav')
 
     def play_eat(self):
@@ -0,0 +1,109 @@
+"""Forward pass of a stable_baselines MlpPolicy in NumPy.
+
+PPO2 models are saved as zip files holding their parameters in an npz
+archive. The policy layers are read from it without stable_baselines or
+TensorFlow, and exported to a small npz file:
+    layer_<i>_w, layer_<i>_b: hidden layers, shared ones first, with tanh
+    logits_w, logits_b: action logits
+"""
+
+import io
+import json
+import zipfile
+import numpy as np
+
+_SCOPE = 'model/'
+
+def load_ppo2_parameters(filename):
+    """Returns the parameters of a PPO2 zip file by TensorFlow name."""
+    with zipfile.ZipFile(filename) as archive:
+        names = json.loads(archive.read('parameter_list'))
+        params = np.load(io.BytesIO(archive.read('parameters')))
+        return {name: params[name] for name in names}
+
+def load_ppo2_data(filename):
+    """Returns the hyperparameters saved in a PPO2 zip file, such as
+    n_envs, without loading the model."""
+    with zipfile.ZipFile(filename) as archive:
+        return json.loads(archive.read('data'))
+
+def _layers(params, prefix):
+    layers = []
+    while f'{_SCOPE}{prefix}{len(layers)}/w:0' in params:
+        i = len(layers)
+        layers.append((params[f'{_SCOPE}{prefix}{i}/w:0'], params[f'{_SCOPE}{prefix}{i}/b:0']))
+    return layers
+
+def policy_arrays(params):
+    """Returns the arrays of the policy network, as stored by
+    export_mlp_policy, from PPO2 parameters."""
+    if f'{_SCOPE}pi/w:0' not in params:
+        raise ValueError('Not the parameters of an MlpPolicy')
+    layers = _layers(params, 'shared_fc') + _layers(params, 'pi_fc')
+    arrays = {}
+    for i, (weights, bias) in enumerate(layers):
+        arrays[f'layer_{i}_w'] = weights.astype(np.float32)
+        arrays[f'layer_{i}_b'] = bias.astype(np.float32)
+    arrays['logits_w'] = params[f'{_SCOPE}pi/w:0'].astype(np.float32)
+    arrays['logits_b'] = params[f'{_SCOPE}pi/b:0'].astype(np.float32)
+    return arrays
+
+def export_mlp_policy(model_filename, npz_filename):
+    """Writes the policy of a PPO2 zip file into an npz file."""
+    arrays = policy_arrays(load_ppo2_parameters(model_filename))
+    with open(npz_filename, 'wb') as f:
+        np.savez(f, **arrays)
+    return arrays
+
+class NumpyMlpPolicy:
+    """Policy network of an MlpPolicy, evaluated for one observation at a
+    time into preallocated buffers."""
+    def __init__(self, arrays, seed=None):
+        num_layers = sum(1 for name in arrays if name.endswith('_w')) - 1
+        self.layers = [(arrays[f'layer_{i}_w'], arrays[f'layer_{i}_b']) for i in range(num_layers)]
+        self.logits_w = arrays['logits_w']
+        self.logits_b = arrays['logits_b']
+        input_size = (self.layers[0][0] if self.layers else self.logits_w).shape[0]
+        self.input = np.zeros(input_size, dtype=np.float32)
+        self.buffers = [np.zeros(bias.shape, dtype=np.float32) for _weights, bias in self.layers]
+        self.logits = np.zeros(self.logits_b.shape, dtype=np.float32)
+        self.probabilities = np.zeros(self.logits_b.shape, dtype=np.float64)
+        self.rng = np.random.RandomState(seed)
+
+    def seed(self, seed):
+        self.rng.seed(seed)
+
+    @classmethod
+    def load(cls, filename, seed=None):
+        with np.load(filename) as arrays:
+            return cls({name: arrays[name] for name in arrays.files}, seed)
+
+    def forward(self, observation):
+        """Returns the action logits of an observation. The array is reused
+        by the next call."""
+        np.copyto(self.input, np.reshape(observation, -1))
+        x = self.input
+        for (weights, bias), out in zip(self.layers, self.buffers):
+            np.dot(x, weights, out=out)
+            out += bias
+            np.tanh(out, out=out)
+            x = out
+        np.dot(x, self.logits_w, out=self.logits)
+        self.logits += self.logits_b
+        return self.logits
+
+    def action_probability(self, observation):
+        logits = self.forward(observation)
+        np.subtract(logits, logits.max(), out=self.probabilities)
+        np.exp(self.probabilities, out=self.probabilities)
+        self.probabilities /= self.probabilities.sum()
+        return self.probabilities
+
+    def predict(self, observation, deterministic=False):
+        """Returns an action, sampled from the policy, or the most likely one
+        if deterministic, with no recurrent state, as PPO2.predict does."""
+        if deterministic:
+            return int(np.argmax(self.forward(observation))), None
+        cumulative = np.cumsum(self.action_probability(observation))
+        action = np.searchsorted(cumulative, self.rng.uniform() * cumulative[-1], side='right')
+        return int(min(action, cumulative.size - 1)), None
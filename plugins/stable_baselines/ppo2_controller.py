@@ -2,17 +2,35 @@
 """
 
 from os import path
-from stable_baselines import PPO2
 from plugins.base_controller import BaseController
+from plugins.stable_baselines.mlp_policy import NumpyMlpPolicy
 
 class Ppo2Controller(BaseController):
+    """Plays with a PPO2 model from the models directory. A policy exported
+    to an .npz file by export_policy.py runs in NumPy, without loading
+    stable_baselines or TensorFlow."""
     def __init__(self, *args):
         if not args:
             raise SystemExit('No model file given')
         model_filename = args[0]
+        self.deterministic = False
         fullpath = path.join('models', model_filename)
-        self.model = PPO2.load(fullpath)
+        if model_filename.endswith('.npz'):
+            self.model = NumpyMlpPolicy.load(fullpath)
+        else:
+            from stable_baselines import PPO2
+            self.model = PPO2.load(fullpath)
+
+    def seed(self, seed):
+        """Makes actions repeatable, for evaluations. Exported policies
+        sample them from a generator seeded with seed. Sampling ops of a
+        loaded TensorFlow graph can't be reseeded, so PPO2 models play their
+        most likely action instead."""
+        if isinstance(self.model, NumpyMlpPolicy):
+            self.model.seed(seed)
+        else:
+            self.deterministic = True
 
     def _computed_action(self, state, curr_dir):
-        action, _states = self.model.predict(state)
+        action, _states = self.model.predict(state, deterministic=self.deterministic)
         return action
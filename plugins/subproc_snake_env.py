@@ -0,0 +1,206 @@
+"""Snake games run by worker processes that share observation memory.
+"""
+
+import bisect
+import multiprocessing as mp
+import numpy as np
+from gym import spaces
+from stable_baselines.common.vec_env import VecEnv
+from plugins.snake_env import SnakeEnv
+
+def _shared_array(ctx, dtype, shape):
+    """Allocates a lock-free shared buffer, returning it with a NumPy view."""
+    dtype = np.dtype(dtype)
+    raw = ctx.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+    return raw, np.frombuffer(raw, dtype=dtype).reshape(shape)
+
+def _views(buffers, shapes):
+    return [np.frombuffer(raw, dtype=dtype).reshape(shape)
+            for raw, (dtype, shape) in zip(buffers, shapes)]
+
+def _game_command(cmd, env, name, args, kwargs):
+    if cmd == 'call':
+        return getattr(env, name)(*args, **kwargs)
+    if cmd == 'get_attr':
+        return getattr(env, name)
+    return setattr(env, name, args[0])
+
+def _worker(remote, parent_remote, env_slice, grid_size, seed, buffers, shapes):
+    """Steps the games of one slice of the vector env. Actions are read from
+    shared memory and results written back to it, so only short commands
+    and acknowledgements go through the pipe. Game i is seeded with seed + i.
+    Methods and attributes of the games are reached with the 'call',
+    'get_attr' and 'set_attr' commands, whose results, or the exception
+    raised, are sent back."""
+    parent_remote.close()
+    obs, terminal_obs, actions, rewards, dones, ep_rewards, ep_lengths = _views(buffers, shapes)
+    first = env_slice[0]
+    envs = [SnakeEnv(grid_size=grid_size, seed=None if seed is None else seed + i,
+                     reuse_obs=True)
+            for i in range(*env_slice)]
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == 'step':
+                for i, env in enumerate(envs, first):
+                    state, reward, done, _info = env.step(actions[i])
+                    rewards[i] = reward
+                    dones[i] = done
+                    ep_rewards[i] += reward
+                    ep_lengths[i] += 1
+                    if done:
+                        terminal_obs[i] = state
+                        state = env.reset()
+                    obs[i] = state
+            elif cmd == 'reset':
+                for i, env in enumerate(envs, first):
+                    obs[i] = env.reset()
+                    ep_rewards[i] = 0
+                    ep_lengths[i] = 0
+            elif cmd in ('call', 'get_attr', 'set_attr'):
+                name, indices, args, kwargs = data
+                try:
+                    remote.send([_game_command(cmd, envs[i - first], name, args, kwargs)
+                                 for i in indices])
+                except Exception as e: # pylint: disable=broad-except
+                    remote.send(e)
+                continue
+            elif cmd == 'close':
+                break
+            remote.send(None)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        remote.close()
+
+class SubprocSnakeEnv(VecEnv):
+    """Vector env spreading num_envs SnakeEnv games over worker processes.
+
+    Each worker steps a contiguous slice of the games, so one step call
+    sends a single command per worker. Observations, rewards and dones are
+    written by the workers straight into shared arrays instead of being
+    pickled through the pipes. Finished games are reset by their worker,
+    and the observation of the last step is available in the info dict under
+    'terminal_observation'.
+    """
+    def __init__(self, num_envs, grid_size=40, seed=None, num_workers=None,
+                 start_method=None, reuse_obs=False):
+        observation_space = spaces.Box(0, 3, (grid_size, grid_size, 1))
+        VecEnv.__init__(self, num_envs, observation_space, spaces.Discrete(3))
+        self.grid_size = grid_size
+        self.reuse_obs = reuse_obs
+        num_workers = min(num_workers or mp.cpu_count(), num_envs)
+        if start_method is None:
+            # Forking a process that already runs TensorFlow is not safe
+            forkserver = 'forkserver' in mp.get_all_start_methods()
+            start_method = 'forkserver' if forkserver else 'spawn'
+        ctx = mp.get_context(start_method)
+
+        obs_shape = (num_envs, grid_size, grid_size, 1)
+        shapes = [
+            (np.uint8, obs_shape),   # observations
+            (np.uint8, obs_shape),   # terminal observations
+            (np.int32, (num_envs,)), # actions
+            (np.float32, (num_envs,)), # rewards
+            (np.bool_, (num_envs,)), # dones
+            (np.float32, (num_envs,)), # episode rewards
+            (np.int32, (num_envs,)), # episode lengths
+        ]
+        buffers = []
+        views = []
+        for dtype, shape in shapes:
+            raw, view = _shared_array(ctx, dtype, shape)
+            buffers.append(raw)
+            views.append(view)
+        self._obs, self._terminal_obs, self._actions, self._rewards, self._dones, \
+            self._ep_rewards, self._ep_lengths = views
+
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        self._bounds = bounds.tolist()
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for rank, (work_remote, remote) in enumerate(zip(self.work_remotes, self.remotes)):
+            args = (work_remote, remote, (bounds[rank], bounds[rank + 1]), grid_size,
+                    seed, buffers, shapes)
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+        self.waiting = False
+        self.closed = False
+
+    def _send_all(self, cmd):
+        for remote in self.remotes:
+            remote.send((cmd, None))
+
+    def _wait_all(self):
+        for remote in self.remotes:
+            remote.recv()
+
+    def _observation(self):
+        return self._obs if self.reuse_obs else self._obs.copy()
+
+    def reset(self):
+        self._send_all('reset')
+        self._wait_all()
+        return self._observation()
+
+    def step_async(self, actions):
+        self._actions[:] = np.asarray(actions).reshape(self.num_envs)
+        self._send_all('step')
+        self.waiting = True
+
+    def step_wait(self):
+        self._wait_all()
+        self.waiting = False
+        infos = [{} for _ in range(self.num_envs)]
+        for i in np.flatnonzero(self._dones):
+            infos[i]['terminal_observation'] = self._terminal_obs[i].copy()
+            infos[i]['episode'] = {'r': float(self._ep_rewards[i]),
+                                   'l': int(self._ep_lengths[i])}
+            self._ep_rewards[i] = 0
+            self._ep_lengths[i] = 0
+        return self._observation(), self._rewards.copy(), self._dones.copy(), infos
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            self._wait_all()
+        self._send_all('close')
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def _game_command(self, cmd, name, indices, args=(), kwargs=None):
+        """Sends a command to the workers of the games in indices only, and
+        returns the result of each game in the order of indices."""
+        indices = list(self._get_indices(indices))
+        by_worker = {}
+        for i in indices:
+            rank = bisect.bisect_right(self._bounds, i) - 1
+            by_worker.setdefault(rank, []).append(i)
+        for rank, worker_indices in by_worker.items():
+            self.remotes[rank].send((cmd, (name, worker_indices, args, kwargs or {})))
+        results = {}
+        error = None
+        for rank, worker_indices in by_worker.items():
+            reply = self.remotes[rank].recv()
+            if isinstance(reply, Exception):
+                error = reply
+            else:
+                results.update(zip(worker_indices, reply))
+        if error is not None:
+            raise error
+        return [results[i] for i in indices]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._game_command('get_attr', attr_name, indices)
+
+    def set_attr(self, attr_name, value, indices=None):
+        self._game_command('set_attr', attr_name, indices, (value,))
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        """Calls a method of the games in indices, in their worker processes.
+        Observations of the vector env are not updated by the call."""
+        return self._game_command('call', method_name, indices, method_args, method_kwargs)
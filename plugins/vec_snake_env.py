@@ -0,0 +1,215 @@
+"""Snake games stepped in lockstep with NumPy, for fast training.
+"""
+
+import numpy as np
+from gym import spaces
+from stable_baselines.common.vec_env import VecEnv
+from plugins.snake_env import SnakeEnv, APPLE_REWARD, DEATH_PENALTY, SNAKE_GROWTH
+
+# Directions are numbered clockwise, starting from 'u'
+_DIRECTIONS = 'urdl'
+_DY = np.array([-1, 0, 1, 0])
+_DX = np.array([0, 1, 0, -1])
+_TURN = np.array([0, -1, 1]) # 0 do nothing, 1 turn left, 2 turn right
+_MAX_SPAWN_TRIES = 8 # Random tries before searching the free cells of a board
+
+class VecSnakeEnv(VecEnv):
+    """Runs num_envs snake games with the same rules as SnakeEnv, with all
+    the state kept in stacked arrays, so that a single step call advances
+    every game. Games that end are reset right away, and the observation of
+    the last step is available in the info dict under 'terminal_observation'.
+
+    Each snake body is a ring buffer of flat cell indices. Cells outside of
+    the grid (the head of a dead snake or the initial tail on tiny grids)
+    are mapped to an extra sink cell after the last one, which is never
+    part of an observation.
+
+    The environments share one RandomState, so apples follow a different
+    sequence than in SnakeEnv for the same seed.
+    """
+    def __init__(self, num_envs, grid_size=40, seed=None, reuse_obs=False):
+        observation_space = spaces.Box(0, 3, (grid_size, grid_size, 1))
+        VecEnv.__init__(self, num_envs, observation_space, spaces.Discrete(3))
+        self.grid_size = grid_size
+        self.reuse_obs = reuse_obs
+        self.arena_length = grid_size * grid_size
+        self.rng = np.random.RandomState(seed)
+        self._rows = np.arange(num_envs)
+        self._sink = self.arena_length
+        capacity = self.arena_length + 2
+        self._body = np.zeros((num_envs, capacity), dtype=np.int32)
+        self._ptr = np.zeros(num_envs, dtype=np.int32) # Index of head in body
+        self._length = np.zeros(num_envs, dtype=np.int32)
+        self._extend = np.zeros(num_envs, dtype=np.int32)
+        self._dir = np.zeros(num_envs, dtype=np.int32)
+        self._head_y = np.zeros(num_envs, dtype=np.int32)
+        self._head_x = np.zeros(num_envs, dtype=np.int32)
+        self._apple = np.zeros(num_envs, dtype=np.int32)
+        # Number of segments from snake[1:-1] on each cell, plus the sink
+        self._count = np.zeros((num_envs, self.arena_length + 1), dtype=np.int32)
+        self._grid = np.zeros((num_envs, self.arena_length + 1), dtype=np.uint8)
+        self._obs = np.zeros((num_envs, grid_size, grid_size, 1), dtype=np.uint8)
+        self._ep_rewards = np.zeros(num_envs, dtype=np.float32)
+        self._ep_lengths = np.zeros(num_envs, dtype=np.int32)
+        self._actions = None
+
+        # Same starting snake as SnakeEnv.build_snake
+        start_length = max([grid_size // 6, 2])
+        self._start_head = (grid_size // 2 + 1, grid_size // 2 + 1)
+        start_y = self._start_head[0] + np.arange(start_length)
+        self._start_cells = np.where(
+            start_y < grid_size, start_y * grid_size + self._start_head[1], self._sink)
+        self._reset_rows(self._rows)
+
+    @property
+    def curr_dirs(self):
+        """Current direction of each snake, as the letters used by SnakeEnv."""
+        return [_DIRECTIONS[d] for d in self._dir]
+
+    def _cell(self, y, x):
+        inside = (y >= 0) & (y < self.grid_size) & (x >= 0) & (x < self.grid_size)
+        return np.where(inside, y * self.grid_size + x, self._sink), ~inside
+
+    def _segment(self, rows, index):
+        """Flat cell of the given segment index (0 being the head) in each row."""
+        return self._body[rows, (self._ptr[rows] + index) % self._body.shape[1]]
+
+    def _occupied(self, rows, cells):
+        tails = self._segment(rows, self._length[rows] - 1)
+        return (self._count[rows, cells] > 0) | (cells == self._segment(rows, 0)) \
+               | (cells == tails)
+
+    def _repaint(self, rows, cells):
+        """Updates grid values of one cell per row. Body segments are drawn
+        over the head, which is drawn over the apple."""
+        heads = self._segment(rows, 0)
+        self._grid[rows, cells] = np.where(
+            self._count[rows, cells] > 0, SnakeEnv.COLL_GRID_VAL,
+            np.where(cells == heads, SnakeEnv.HEAD_GRID_VAL,
+                     np.where(cells == self._apple[rows], SnakeEnv.APPLE_GRID_VAL, 0)))
+
+    def _spawn_apples(self, rows):
+        """Places an apple on a free cell of each given row. Rows that keep
+        hitting the snake fall back to choosing among their free cells."""
+        cells = self.rng.randint(self.arena_length, size=rows.size)
+        pending = self._occupied(rows, cells)
+        tries = 1
+        while pending.any() and tries < _MAX_SPAWN_TRIES:
+            cells[pending] = self.rng.randint(self.arena_length, size=pending.sum())
+            pending[pending] = self._occupied(rows[pending], cells[pending])
+            tries += 1
+        for i in np.flatnonzero(pending):
+            row = rows[i]
+            free = self._count[row, :self.arena_length] == 0
+            free[self._segment(row, 0)] = False
+            tail = self._segment(row, self._length[row] - 1)
+            if tail < self.arena_length:
+                free[tail] = False
+            free_cells = np.flatnonzero(free)
+            cells[i] = self.rng.choice(free_cells) if free_cells.size else self._sink
+        self._apple[rows] = cells
+        self._repaint(rows, cells)
+
+    def _reset_rows(self, rows):
+        start = self._start_cells
+        self._count[rows] = 0
+        self._grid[rows] = 0
+        self._body[rows, :start.size] = start
+        self._ptr[rows] = 0
+        self._length[rows] = start.size
+        self._extend[rows] = 0
+        self._dir[rows] = _DIRECTIONS.index('l')
+        self._head_y[rows], self._head_x[rows] = self._start_head
+        self._apple[rows] = self._sink
+        self._ep_rewards[rows] = 0
+        self._ep_lengths[rows] = 0
+        middle = start[1:-1]
+        middle = middle[middle != self._sink]
+        self._count[np.ix_(rows, middle)] += 1
+        self._grid[np.ix_(rows, middle)] = SnakeEnv.COLL_GRID_VAL
+        self._repaint(rows, start[0].repeat(rows.size))
+        self._spawn_apples(rows)
+
+    def _observation(self):
+        out = self._obs if self.reuse_obs else np.empty_like(self._obs)
+        out.reshape(self.num_envs, -1)[:] = self._grid[:, :self.arena_length]
+        return out
+
+    def reset(self):
+        self._reset_rows(self._rows)
+        return self._observation()
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions).reshape(self.num_envs)
+
+    def step_wait(self):
+        rows = self._rows
+        capacity = self._body.shape[1]
+        self._dir = (self._dir + _TURN[self._actions]) % 4
+        old_heads = self._segment(rows, 0)
+        self._head_y += _DY[self._dir]
+        self._head_x += _DX[self._dir]
+        heads, outside = self._cell(self._head_y, self._head_x)
+        self._ptr = (self._ptr - 1) % capacity
+        self._body[rows, self._ptr] = heads
+
+        # The old head becomes the neck, and the segment before the old
+        # tail becomes the new tail, which the head can't collide with
+        grow = self._extend >= 0
+        self._extend[grow] -= 1
+        self._length[grow] += 1
+        self._count[rows, old_heads] += 1
+        shrink = rows[~grow]
+        new_tails = self._segment(shrink, self._length[shrink] - 1)
+        self._count[shrink, new_tails] -= 1
+
+        dones = outside | (self._count[rows, heads] > 0)
+        ate = ~dones & (heads == self._apple)
+        rewards = np.where(dones, -abs(DEATH_PENALTY), np.where(ate, APPLE_REWARD, 0)) \
+                    .astype(np.float32)
+        self._extend[ate] += SNAKE_GROWTH
+
+        self._repaint(rows, old_heads)
+        self._repaint(shrink, new_tails)
+        self._repaint(rows, heads)
+        eaters = rows[ate]
+        if eaters.size:
+            self._spawn_apples(eaters)
+        dones |= self._length > self.arena_length
+
+        self._ep_rewards += rewards
+        self._ep_lengths += 1
+        obs = self._observation()
+        infos = [{} for _ in rows]
+        finished = rows[dones]
+        if finished.size:
+            for i in finished:
+                infos[i]['terminal_observation'] = obs[i].copy()
+                infos[i]['episode'] = {'r': float(self._ep_rewards[i]),
+                                       'l': int(self._ep_lengths[i])}
+            self._reset_rows(finished)
+            obs.reshape(self.num_envs, -1)[finished] = \
+                self._grid[finished, :self.arena_length]
+        return obs, rewards, dones, infos
+
+    def close(self):
+        pass
+
+    def seed(self, seed=None):
+        self.rng = np.random.RandomState(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        """Attributes are shared by all the games, so each index gets the
+        attribute of the vector env."""
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        if indices is not None and sorted(self._get_indices(indices)) != list(range(self.num_envs)):
+            raise ValueError('Attributes of VecSnakeEnv are shared by all its games, '
+                             'set them with indices=None')
+        setattr(self, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise AttributeError("VecSnakeEnv games are rows of shared arrays, not envs with "
+                             f"their own '{method_name}' method; call the vector env instead")
@@ -3,25 +3,29 @@
 from os import path
 
 from stable_baselines.common.policies import MlpPolicy
-from stable_baselines.common.vec_env import DummyVecEnv
 from stable_baselines import PPO2
-from plugins.snake_env import SnakeEnv
+from plugins.vec_snake_env import VecSnakeEnv
+from plugins.stable_baselines.mlp_policy import load_ppo2_data
 
-# Optional: PPO2 requires a vectorized environment to run
-# the env is now wrapped automatically when passing it to the constructor
+# Games stepped together in a single vectorized env. PPO2 collects n_steps
+# steps of each game per update, so this also scales its batches
+NUM_ENVS = 8
 
-env = SnakeEnv(grid_size=4)
-# env = SnakeEnv(grid_size=6)
 learning_rate = 0.0005
 # model_name = 'ppo2_grid6_alpha0'
 # model_name = 'ppo2_grid6_stupid'
 model_name = 'ppo2_grid4_alpha0'
 model_path = path.join('models', model_name)
 if path.isfile(model_path + '.zip'):
-    print('---- Loading file: ', model_path)
-    env = DummyVecEnv([lambda: env])
+    # Models keep the batch sizes they were trained with, one game for
+    # those saved before games were vectorized
+    num_envs = load_ppo2_data(model_path + '.zip').get('n_envs', 1)
+    print('---- Loading file: ', model_path, f'({num_envs} games per step)')
+    env = VecSnakeEnv(num_envs, grid_size=4)
     model = PPO2.load(model_path, env=env, learning_rate=learning_rate, tensorboard_log=f'./logs/{model_name}')
 else:
+    env = VecSnakeEnv(NUM_ENVS, grid_size=4)
+    # env = VecSnakeEnv(NUM_ENVS, grid_size=6)
     model = PPO2(MlpPolicy, env=env, learning_rate=learning_rate, tensorboard_log=f'./logs/{model_name}')
 
 timesteps = 10_000_000
@@ -4,22 +4,24 @@ from os import path
 
 from multiprocessing import Pool
 from stable_baselines.common.policies import MlpPolicy
-from stable_baselines.common.vec_env import DummyVecEnv
 from stable_baselines import PPO2
-from plugins.snake_env import SnakeEnv
+from plugins.vec_snake_env import VecSnakeEnv
+from plugins.stable_baselines.mlp_policy import load_ppo2_data
 
-# Optional: PPO2 requires a vectorized environment to run
-# the env is now wrapped automatically when passing it to the constructor
+# Games stepped together in each training process, which scales the PPO2
+# batches as in train.py
+NUM_ENVS = 8
 
 def train(model_payload):
-    env = SnakeEnv(grid_size=4)
     model_name = model_payload['name']
     model_path = path.join('models', model_name)
     learning_rate = model_payload['learning_rate']
-    if path.isfile(model_path):
-        env = DummyVecEnv([lambda: env])
-        model = PPO2.load('model_path', env=env, learning_rate=learning_rate, tensorboard_log=f'./logs/{model_name}')
+    if path.isfile(model_path + '.zip'):
+        # Models keep the number of games they were trained with
+        env = VecSnakeEnv(load_ppo2_data(model_path + '.zip').get('n_envs', 1), grid_size=4)
+        model = PPO2.load(model_path, env=env, learning_rate=learning_rate, tensorboard_log=f'./logs/{model_name}')
     else:
+        env = VecSnakeEnv(NUM_ENVS, grid_size=4)
         model = PPO2(MlpPolicy, env=env, learning_rate=learning_rate, tensorboard_log=f'./logs/{model_name}')
 
     model.learn(total_timesteps=1000000)